@@ -26,12 +26,12 @@ mod tests {
 
     use super::*;
 
-    #[test]
-    fn test_verify_token_header() {
-        let settings = Settings {
+    // Only the token matters to verify_token; everything else is filler
+    fn settings_with_token(auth_token: &str) -> Settings {
+        Settings {
             scraper_base_url: Url::parse("https://example.com").unwrap(),
             debug: false,
-            auth_token: "secret".to_string(),
+            auth_token: auth_token.to_string(),
             enable_swagger: true,
             port: 8080,
             location: None,
@@ -39,25 +39,19 @@ mod tests {
             gym_longitude: 22.0026,
             gym_title: "CrossFit 2.0 Rzeszów".to_string(),
             gym_location: "Boya-Żeleńskiego 15, 35-105 Rzeszów, Poland".to_string(),
-        };
+        }
+    }
+
+    #[test]
+    fn test_verify_token_header() {
+        let settings = settings_with_token("secret");
         let auth = Authorization::bearer("secret").unwrap();
         assert!(verify_token(&settings, Some(auth), None).is_ok());
     }
 
     #[test]
     fn test_verify_token_query() {
-        let settings = Settings {
-            scraper_base_url: Url::parse("https://example.com").unwrap(),
-            debug: false,
-            auth_token: "secret".to_string(),
-            enable_swagger: true,
-            port: 8080,
-            location: None,
-            gym_latitude: 50.0386,
-            gym_longitude: 22.0026,
-            gym_title: "CrossFit 2.0 Rzeszów".to_string(),
-            gym_location: "Boya-Żeleńskiego 15, 35-105 Rzeszów, Poland".to_string(),
-        };
+        let settings = settings_with_token("secret");
         assert!(verify_token(&settings, None, Some("secret")).is_ok());
         assert!(verify_token(&settings, None, Some("bad")).is_err());
     }
@@ -0,0 +1,259 @@
+use std::collections::HashMap;
+use std::future::Future;
+use std::hash::Hash;
+use std::sync::{Arc, Mutex, PoisonError};
+use std::time::Duration;
+
+use tokio::sync::Mutex as AsyncMutex;
+// Tokio's clock follows the runtime, so paused test runtimes can move it
+// forward instead of sleeping through a TTL
+use tokio::time::Instant;
+
+struct Entry<V> {
+    fetched_at: Instant,
+    value: V,
+}
+
+type Slot<V> = Arc<AsyncMutex<Option<Entry<V>>>>;
+
+// In-memory cache whose entries expire `ttl` after they were stored.
+//
+// Each key has its own async lock, so concurrent callers asking for the same
+// missing key wait for a single in-flight fetch instead of all fetching it.
+// Errors are never cached. Expired entries can be kept for up to `retention`
+// and handed to the next fetch, so it can revalidate them instead of
+// fetching from scratch.
+pub struct TtlCache<K, V> {
+    ttl: Duration,
+    retention: Duration,
+    slots: Mutex<HashMap<K, Slot<V>>>,
+}
+
+impl<K, V> TtlCache<K, V>
+where
+    K: Eq + Hash,
+    V: Clone,
+{
+    #[cfg(test)]
+    pub fn new(ttl: Duration) -> Self {
+        Self::with_retention(ttl, ttl)
+    }
+
+    pub fn with_retention(ttl: Duration, retention: Duration) -> Self {
+        Self {
+            ttl,
+            retention: retention.max(ttl),
+            slots: Mutex::new(HashMap::new()),
+        }
+    }
+
+    #[cfg(test)]
+    pub async fn get_or_try_insert_with<F, Fut, E>(&self, key: K, fetch: F) -> Result<V, E>
+    where
+        F: FnOnce() -> Fut,
+        Fut: Future<Output = Result<V, E>>,
+    {
+        self.get_or_try_revalidate_with(key, |_| fetch()).await
+    }
+
+    // Returns the live value for `key`, or runs `fetch` to replace it. The fetch
+    // receives the expired value, if one is still retained for the key
+    pub async fn get_or_try_revalidate_with<F, Fut, E>(&self, key: K, fetch: F) -> Result<V, E>
+    where
+        F: FnOnce(Option<V>) -> Fut,
+        Fut: Future<Output = Result<V, E>>,
+    {
+        let slot = self.slot(key);
+        let mut entry = slot.lock().await;
+        if let Some(cached) = entry.as_ref()
+            && self.is_fresh(cached)
+        {
+            return Ok(cached.value.clone());
+        }
+
+        // The fetch gets a copy, so a failed or cancelled fetch leaves the
+        // expired entry in place for the next attempt to revalidate
+        let stale = entry.as_ref().map(|e| e.value.clone());
+        let value = fetch(stale).await?;
+        *entry = Some(Entry {
+            fetched_at: Instant::now(),
+            value: value.clone(),
+        });
+        Ok(value)
+    }
+
+    fn slot(&self, key: K) -> Slot<V> {
+        let mut slots = self.slots.lock().unwrap_or_else(PoisonError::into_inner);
+        // Drop entries past their retention that nobody is using. A slot
+        // another caller has cloned but not locked yet is in use too:
+        // replacing it would let that caller and the next one fetch the same
+        // key side by side.
+        slots.retain(|_, slot| {
+            if Arc::strong_count(slot) > 1 {
+                return true;
+            }
+            match slot.try_lock() {
+                Ok(entry) => entry
+                    .as_ref()
+                    .is_some_and(|e| e.fetched_at.elapsed() < self.retention),
+                Err(_) => true,
+            }
+        });
+        Arc::clone(slots.entry(key).or_default())
+    }
+
+    fn is_fresh(&self, entry: &Entry<V>) -> bool {
+        entry.fetched_at.elapsed() < self.ttl
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use std::sync::atomic::{AtomicUsize, Ordering};
+
+    use futures::FutureExt;
+
+    use super::*;
+
+    #[tokio::test]
+    async fn test_returns_cached_value() {
+        let cache = TtlCache::new(Duration::from_secs(60));
+        let calls = AtomicUsize::new(0);
+        let fetch = || async {
+            calls.fetch_add(1, Ordering::SeqCst);
+            Ok::<_, ()>(42)
+        };
+
+        assert_eq!(cache.get_or_try_insert_with("key", fetch).await, Ok(42));
+        assert_eq!(cache.get_or_try_insert_with("key", fetch).await, Ok(42));
+        assert_eq!(calls.load(Ordering::SeqCst), 1);
+    }
+
+    #[tokio::test]
+    async fn test_coalesces_concurrent_fetches() {
+        let cache = TtlCache::new(Duration::from_secs(60));
+        let calls = AtomicUsize::new(0);
+        let fetch = || async {
+            calls.fetch_add(1, Ordering::SeqCst);
+            tokio::task::yield_now().await;
+            Ok::<_, ()>("value")
+        };
+
+        let (first, second) = tokio::join!(
+            cache.get_or_try_insert_with(1, fetch),
+            cache.get_or_try_insert_with(1, fetch)
+        );
+
+        assert_eq!(first, Ok("value"));
+        assert_eq!(second, Ok("value"));
+        assert_eq!(calls.load(Ordering::SeqCst), 1);
+    }
+
+    #[tokio::test]
+    async fn test_does_not_cache_errors() {
+        let cache = TtlCache::new(Duration::from_secs(60));
+
+        let failed = cache
+            .get_or_try_insert_with("key", || async { Err::<u8, _>("boom") })
+            .await;
+        let retried = cache
+            .get_or_try_insert_with("key", || async { Ok::<_, &str>(7) })
+            .await;
+
+        assert_eq!(failed, Err("boom"));
+        assert_eq!(retried, Ok(7));
+    }
+
+    #[tokio::test]
+    async fn test_expired_entries_are_refetched() {
+        let cache = TtlCache::new(Duration::ZERO);
+
+        let first = cache
+            .get_or_try_insert_with("key", || async { Ok::<_, ()>(1) })
+            .await;
+        let second = cache
+            .get_or_try_insert_with("key", || async { Ok::<_, ()>(2) })
+            .await;
+
+        assert_eq!(first, Ok(1));
+        assert_eq!(second, Ok(2));
+    }
+
+    #[tokio::test(start_paused = true)]
+    async fn test_entries_expire_after_ttl() {
+        let cache = TtlCache::new(Duration::from_secs(300));
+        let calls = AtomicUsize::new(0);
+        let fetch = || async { Ok::<_, ()>(calls.fetch_add(1, Ordering::SeqCst)) };
+
+        assert_eq!(cache.get_or_try_insert_with("key", fetch).await, Ok(0));
+        tokio::time::advance(Duration::from_secs(299)).await;
+        assert_eq!(cache.get_or_try_insert_with("key", fetch).await, Ok(0));
+        tokio::time::advance(Duration::from_secs(1)).await;
+        assert_eq!(cache.get_or_try_insert_with("key", fetch).await, Ok(1));
+    }
+
+    #[tokio::test]
+    async fn test_expired_entries_are_passed_to_revalidation() {
+        let cache = TtlCache::with_retention(Duration::ZERO, Duration::from_secs(60));
+
+        let first = cache
+            .get_or_try_revalidate_with("key", |stale| async move {
+                assert_eq!(stale, None);
+                Ok::<_, ()>(1)
+            })
+            .await;
+        let second = cache
+            .get_or_try_revalidate_with("key", |stale| async move {
+                assert_eq!(stale, Some(1));
+                Ok::<_, ()>(2)
+            })
+            .await;
+
+        assert_eq!(first, Ok(1));
+        assert_eq!(second, Ok(2));
+    }
+
+    #[tokio::test]
+    async fn test_failed_revalidation_keeps_expired_entry() {
+        let cache = TtlCache::with_retention(Duration::ZERO, Duration::from_secs(60));
+        let _ = cache
+            .get_or_try_insert_with("key", || async { Ok::<_, ()>(1) })
+            .await;
+
+        let failed = cache
+            .get_or_try_revalidate_with("key", |_| async { Err::<u8, _>("boom") })
+            .await;
+        // A fetch dropped midway, like a sibling week of a failed batch
+        let cancelled = cache
+            .get_or_try_revalidate_with("key", |_| std::future::pending::<Result<u8, ()>>())
+            .now_or_never();
+        let retried = cache
+            .get_or_try_revalidate_with("key", |stale| async move {
+                assert_eq!(stale, Some(1));
+                Ok::<_, ()>(2)
+            })
+            .await;
+
+        assert_eq!(failed, Err("boom"));
+        assert!(cancelled.is_none());
+        assert_eq!(retried, Ok(2));
+    }
+
+    #[tokio::test]
+    async fn test_sweep_keeps_slots_held_by_other_callers() {
+        let cache = TtlCache::new(Duration::from_secs(60));
+        // A caller that took its slot out of the map but has not locked it yet
+        let held = cache.slot("key");
+
+        // Another caller for the same key sweeps the map before fetching
+        let value = cache
+            .get_or_try_insert_with("key", || async { Ok::<_, ()>(1) })
+            .await;
+
+        // Both went through the same slot, so the first caller finds the
+        // fetched value instead of fetching again
+        assert_eq!(value, Ok(1));
+        assert!(Arc::ptr_eq(&held, &cache.slot("key")));
+        assert_eq!(held.lock().await.as_ref().map(|e| e.value), Some(1));
+    }
+}
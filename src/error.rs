@@ -35,7 +35,9 @@ impl From<ScrapeError> for ApiError {
             ScrapeError::InvalidMonday | ScrapeError::TooOld => {
                 ApiError::BadRequest(value.to_string())
             }
-            ScrapeError::MissingTable => ApiError::Internal(value.to_string()),
+            ScrapeError::MissingTable | ScrapeError::Cancelled => {
+                ApiError::Internal(value.to_string())
+            }
             ScrapeError::Http(err) => {
                 error!("HTTP error: {err}");
                 ApiError::Internal("Failed to fetch timetable".into())
@@ -1,8 +1,12 @@
-use axum::{Json, extract::State, http::StatusCode, response::IntoResponse};
+use axum::{
+    Json,
+    extract::State,
+    http::{HeaderValue, StatusCode, header},
+    response::IntoResponse,
+};
 use axum_extra::extract::TypedHeader;
 use axum_extra::headers::{Authorization, authorization::Bearer};
 use chrono::{Datelike, Duration, Local, NaiveDate};
-use futures::future::try_join_all;
 
 use crate::{
     AppState, auth::verify_token, error::ApiError, models::ClassItem, validation::validate_weeks,
@@ -19,6 +23,31 @@ fn default_weeks() -> u8 {
     1
 }
 
+// Fetches `weeks` consecutive weeks starting from the current Monday,
+// shared by the JSON and iCal endpoints. Both go through the scraper's
+// per-Monday cache, so back-to-back JSON and iCal requests share one
+// upstream fetch (or wait on the same in-flight one) per week, and the
+// location is resolved once per request.
+async fn collect_classes(
+    state: &AppState,
+    weeks: u8,
+    location: Option<String>,
+) -> Result<Vec<ClassItem>, ApiError> {
+    let today = Local::now().date_naive();
+    let current_monday = today - Duration::days(today.weekday().num_days_from_monday() as i64);
+    let mondays: Vec<NaiveDate> = (0..weeks)
+        .map(|i| current_monday + Duration::weeks(i.into()))
+        .collect();
+
+    let classes = state.scraper.fetch_weeks(&mondays, location).await?;
+
+    if classes.is_empty() {
+        return Err(ApiError::NotFound("No classes found".into()));
+    }
+
+    Ok(classes)
+}
+
 #[utoipa::path(get, path = "/", tag = "timetable")]
 pub async fn root() -> impl IntoResponse {
     Json(serde_json::json!({
@@ -64,23 +93,7 @@ pub async fn get_timetable(
     verify_token(&state.settings, auth_header, query.token.as_deref())?;
 
     let weeks = validate_weeks(query.weeks)?;
-
-    let today = Local::now().date_naive();
-    let current_monday = today - Duration::days(today.weekday().num_days_from_monday() as i64);
-    let mondays: Vec<NaiveDate> = (0..weeks)
-        .map(|i| current_monday + Duration::weeks(i.into()))
-        .collect();
-
-    let futures = mondays
-        .into_iter()
-        .map(|monday| state.scraper.fetch_timetable(Some(monday), None));
-
-    let week_results: Vec<Vec<ClassItem>> = try_join_all(futures).await?;
-    let classes: Vec<ClassItem> = week_results.into_iter().flatten().collect();
-
-    if classes.is_empty() {
-        return Err(ApiError::NotFound("No classes found".into()));
-    }
+    let classes = collect_classes(&state, weeks, None).await?;
 
     Ok(Json(classes))
 }
@@ -109,37 +122,20 @@ pub async fn get_ical(
     verify_token(&state.settings, auth_header, query.token.as_deref())?;
     let weeks = validate_weeks(query.weeks)?;
 
-    let today = Local::now().date_naive();
-    let current_monday = today - Duration::days(today.weekday().num_days_from_monday() as i64);
-    let mondays: Vec<NaiveDate> = (0..weeks)
-        .map(|i| current_monday + Duration::weeks(i.into()))
-        .collect();
-
-    let location = match &state.settings.location {
-        Some(loc) => Some(loc.clone()),
-        None => state.scraper.fetch_location().await,
-    };
-    let futures = mondays.into_iter().map(|monday| {
-        state
-            .scraper
-            .fetch_timetable(Some(monday), location.clone())
-    });
-
-    let week_results: Vec<Vec<ClassItem>> = try_join_all(futures).await?;
-    let classes: Vec<ClassItem> = week_results.into_iter().flatten().collect();
-
-    if classes.is_empty() {
-        return Err(ApiError::NotFound("No classes found".into()));
-    }
+    let classes = collect_classes(&state, weeks, state.settings.location.clone()).await?;
 
+    // Static header values need no parsing or validation per response
     let body = state.exporter.generate(&classes, &state.settings);
     Ok((
         StatusCode::OK,
         [
-            ("content-type", "text/calendar"),
             (
-                "content-disposition",
-                "attachment; filename=crossfit_timetable.ics",
+                header::CONTENT_TYPE,
+                HeaderValue::from_static("text/calendar"),
+            ),
+            (
+                header::CONTENT_DISPOSITION,
+                HeaderValue::from_static("attachment; filename=crossfit_timetable.ics"),
             ),
         ],
         body,
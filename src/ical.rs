@@ -1,9 +1,40 @@
-use chrono::Duration;
-use icalendar::{Calendar, Component, Event, EventLike, Property};
+use std::collections::HashMap;
+use std::fmt::Write;
+
+use chrono::{Duration, NaiveDateTime, Utc};
+use icalendar::Calendar;
+use once_cell::sync::Lazy;
 
 use crate::models::ClassItem;
 use crate::settings::Settings;
 
+const CALENDAR_NAME: &str = "CrossFit 2.0 Rzeszów Timetable";
+const CALENDAR_FOOTER: &str = "END:VCALENDAR\r\n";
+const DATE_TIME_FORMAT: &str = "%Y%m%dT%H%M%S";
+const UTC_DATE_TIME_FORMAT: &str = "%Y%m%dT%H%M%SZ";
+const UID_SUFFIX: &str = "-crossfit-timetable";
+// Constant parts of SUMMARY and DESCRIPTION, already escaped, so only the
+// per-class values go through escaping
+const SUMMARY_PREFIX: &str = "SUMMARY:CrossFit: ";
+const DESCRIPTION_PREFIX: &str = "DESCRIPTION:CrossFit Class\\nCoach: ";
+const DESCRIPTION_SOURCE: &str = "\\nSource: ";
+// RFC 5545 §3.1: content lines should not be longer than 75 octets
+const MAX_LINE_OCTETS: usize = 75;
+// Approximate size of a single serialized VEVENT, used to pre-size the output
+const EVENT_SIZE_HINT: usize = 640;
+
+// Calendar-level properties never change between exports, so the header is
+// rendered once with icalendar (without the closing line) and reused as-is
+static CALENDAR_HEADER: Lazy<String> = Lazy::new(|| {
+    let mut calendar = Calendar::new();
+    calendar.name(CALENDAR_NAME);
+    calendar
+        .to_string()
+        .strip_suffix(CALENDAR_FOOTER)
+        .expect("icalendar renders END:VCALENDAR last")
+        .to_string()
+});
+
 #[derive(Clone, Default)]
 pub struct ICalExporter;
 
@@ -13,27 +44,98 @@ impl ICalExporter {
     }
 
     fn create_structured_location(
+        line: &mut String,
         location: &str,
         gym_latitude: f64,
         gym_longitude: f64,
         gym_title: &str,
-    ) -> Property {
+    ) {
         // Format address for X-ADDRESS parameter (use \n for line breaks)
         let address_formatted = location.replace(", ", "\\n");
 
-        // Build the geo URI with coordinates
-        let geo_uri = format!("geo:{},{}", gym_latitude, gym_longitude);
-
         // Create X-APPLE-STRUCTURED-LOCATION property
         // This is an Apple-specific extension (not part of RFC 5545)
         // Enables map integration, travel time alerts, and location-based features
-        let mut property = Property::new("X-APPLE-STRUCTURED-LOCATION", &geo_uri);
-        property.add_parameter("VALUE", "URI");
-        property.add_parameter("X-ADDRESS", &address_formatted);
-        property.add_parameter("X-TITLE", gym_title);
-        property.add_parameter("X-APPLE-RADIUS", "49.91"); // ~50 meters radius
+        line.clear();
+        line.push_str("X-APPLE-STRUCTURED-LOCATION");
+        push_parameter(line, "VALUE", "URI");
+        push_parameter(line, "X-ADDRESS", &address_formatted);
+        push_parameter(line, "X-TITLE", gym_title);
+        push_parameter(line, "X-APPLE-RADIUS", "49.91"); // ~50 meters radius
 
-        property
+        // Geo URI with coordinates as the property value
+        let _ = write!(line, ":geo:{},{}", gym_latitude, gym_longitude);
+    }
+
+    // LOCATION and X-APPLE-STRUCTURED-LOCATION only depend on the location and
+    // the gym settings, so they are rendered (and folded) once per distinct location
+    fn render_location_block(line: &mut String, location: &str, settings: &Settings) -> String {
+        let mut block = String::new();
+        write_text_property(&mut block, line, "LOCATION", location);
+
+        // Add X-APPLE-STRUCTURED-LOCATION for enhanced Apple Calendar support
+        Self::create_structured_location(
+            line,
+            location,
+            settings.gym_latitude,
+            settings.gym_longitude,
+            &settings.gym_title,
+        );
+        push_folded(&mut block, line);
+
+        block
+    }
+
+    // VEVENTs are written straight into the output buffer instead of being
+    // assembled as icalendar components, which avoids building a property
+    // map per event and walking the whole tree again on serialization
+    fn write_event(
+        out: &mut String,
+        line: &mut String,
+        item: &ClassItem,
+        location_block: &str,
+        dtstamp: &str,
+    ) {
+        let end_dt = if let Some(duration) = item.duration_min {
+            item.date + Duration::minutes(duration as i64)
+        } else {
+            item.date + Duration::hours(1)
+        };
+
+        out.push_str("BEGIN:VEVENT\r\n");
+
+        // UID: <start>-<event>-<coach>-crossfit-timetable
+        line.clear();
+        let _ = write!(line, "UID:{}-", item.date.format(DATE_TIME_FORMAT));
+        push_uid_segment(line, &item.event_name);
+        line.push('-');
+        push_uid_segment(line, &item.coach);
+        line.push_str(UID_SUFFIX);
+        push_folded(out, line);
+
+        line.clear();
+        line.push_str("DTSTAMP:");
+        line.push_str(dtstamp);
+        push_folded(out, line);
+
+        write_date_time_property(out, line, "DTSTART", item.date);
+        write_date_time_property(out, line, "DTEND", end_dt);
+
+        line.clear();
+        line.push_str(SUMMARY_PREFIX);
+        push_escaped_text(line, &item.event_name);
+        push_folded(out, line);
+
+        line.clear();
+        line.push_str(DESCRIPTION_PREFIX);
+        push_escaped_text(line, &item.coach);
+        line.push_str(DESCRIPTION_SOURCE);
+        push_escaped_text(line, &item.source_url);
+        push_folded(out, line);
+
+        out.push_str(location_block);
+
+        out.push_str("END:VEVENT\r\n");
     }
 
     pub fn generate(&self, classes: &[ClassItem], settings: &Settings) -> Vec<u8> {
@@ -41,56 +143,111 @@ impl ICalExporter {
             return Vec::new();
         }
 
-        let mut calendar = Calendar::new();
-        calendar.name("CrossFit 2.0 Rzeszów Timetable");
+        let dtstamp = Utc::now().format(UTC_DATE_TIME_FORMAT).to_string();
+        let mut out = String::with_capacity(
+            CALENDAR_HEADER.len() + classes.len() * EVENT_SIZE_HINT + CALENDAR_FOOTER.len(),
+        );
+        let mut line = String::new();
+        // Classes from one export almost always share a single location
+        let mut location_blocks: HashMap<&str, String> = HashMap::new();
 
+        out.push_str(&CALENDAR_HEADER);
         for item in classes {
-            let start = item.date;
-            let end_dt = if let Some(duration) = item.duration_min {
-                item.date + Duration::minutes(duration as i64)
-            } else {
-                item.date + Duration::hours(1)
-            };
-
-            let mut event = Event::new();
-            event.summary(&format!("CrossFit: {}", item.event_name));
-            event.starts(start);
-            event.ends(end_dt);
-            let location = item
-                .location
-                .clone()
-                .unwrap_or_else(|| settings.gym_location.clone());
-            event.location(&location);
-            event.description(&format!(
-                "CrossFit Class\nCoach: {}\nSource: {}",
-                item.coach, item.source_url
-            ));
-            event.uid(&format!(
-                "{}-{}-{}-crossfit-timetable",
-                item.date.format("%Y%m%dT%H%M%S"),
-                item.event_name.replace(' ', "-"),
-                item.coach.replace(' ', "-")
-            ));
-
-            // Add X-APPLE-STRUCTURED-LOCATION for enhanced Apple Calendar support
-            let structured_location = Self::create_structured_location(
-                &location,
-                settings.gym_latitude,
-                settings.gym_longitude,
-                &settings.gym_title,
-            );
-            event.append_property(structured_location);
-
-            calendar.push(event);
+            let location = item.location.as_deref().unwrap_or(&settings.gym_location);
+            let location_block = location_blocks
+                .entry(location)
+                .or_insert_with(|| Self::render_location_block(&mut line, location, settings));
+            Self::write_event(&mut out, &mut line, item, location_block, &dtstamp);
+        }
+        out.push_str(CALENDAR_FOOTER);
+
+        out.into_bytes()
+    }
+}
+
+fn write_text_property(out: &mut String, line: &mut String, name: &str, value: &str) {
+    line.clear();
+    line.push_str(name);
+    line.push(':');
+    push_escaped_text(line, value);
+    push_folded(out, line);
+}
+
+fn write_date_time_property(out: &mut String, line: &mut String, name: &str, value: NaiveDateTime) {
+    line.clear();
+    let _ = write!(line, "{}:{}", name, value.format(DATE_TIME_FORMAT));
+    push_folded(out, line);
+}
+
+// Escapes a TEXT value as described in RFC 5545 §3.3.11
+fn push_escaped_text(line: &mut String, value: &str) {
+    for ch in value.chars() {
+        push_escaped_char(line, ch);
+    }
+}
+
+// UID segments replace spaces with dashes on the fly
+fn push_uid_segment(line: &mut String, value: &str) {
+    for ch in value.chars() {
+        if ch == ' ' {
+            line.push('-');
+        } else {
+            push_escaped_char(line, ch);
         }
+    }
+}
+
+fn push_escaped_char(line: &mut String, ch: char) {
+    match ch {
+        '\\' => line.push_str("\\\\"),
+        ';' => line.push_str("\\;"),
+        ',' => line.push_str("\\,"),
+        '\n' => line.push_str("\\n"),
+        '\r' => {}
+        _ => line.push(ch),
+    }
+}
+
+// Parameter values containing separators must be quoted; DQUOTE itself is not allowed
+fn push_parameter(line: &mut String, name: &str, value: &str) {
+    line.push(';');
+    line.push_str(name);
+    line.push('=');
+    let quoted = value.contains([':', ';', ',']);
+    if quoted {
+        line.push('"');
+    }
+    line.extend(value.chars().filter(|&ch| ch != '"'));
+    if quoted {
+        line.push('"');
+    }
+}
+
+// Appends a content line, folding it into 75-octet chunks without splitting
+// UTF-8 sequences (RFC 5545 §3.1)
+fn push_folded(out: &mut String, line: &str) {
+    if line.len() <= MAX_LINE_OCTETS {
+        out.push_str(line);
+        out.push_str("\r\n");
+        return;
+    }
 
-        calendar.to_string().into_bytes()
+    let mut width = 0;
+    for ch in line.chars() {
+        let len = ch.len_utf8();
+        if width + len > MAX_LINE_OCTETS {
+            out.push_str("\r\n ");
+            width = 1;
+        }
+        out.push(ch);
+        width += len;
     }
+    out.push_str("\r\n");
 }
 
 #[cfg(test)]
 mod tests {
-    use chrono::NaiveDateTime;
+    use chrono::{NaiveDate, NaiveDateTime};
     use url::Url;
 
     use super::*;
@@ -110,23 +267,39 @@ mod tests {
         }
     }
 
+    const CLASS_START: NaiveDateTime = NaiveDate::from_ymd_opt(2025, 11, 24)
+        .unwrap()
+        .and_hms_opt(6, 0, 0)
+        .unwrap();
+
+    // WOD on Monday 2025-11-24 at 06:00; tests override only what they check
+    fn sample_class() -> ClassItem {
+        ClassItem {
+            date: CLASS_START,
+            event_name: "WOD".into(),
+            coach: "Coach".into(),
+            duration_min: Some(60),
+            source_url: "https://example.com".into(),
+            location: None,
+        }
+    }
+
+    #[test]
+    fn test_calendar_header_is_unterminated() {
+        assert!(CALENDAR_HEADER.starts_with("BEGIN:VCALENDAR\r\n"));
+        assert!(!CALENDAR_HEADER.contains("END:VCALENDAR"));
+    }
+
     #[test]
     fn test_generate_single_class() {
         let exporter = ICalExporter::new();
         let settings = create_test_settings();
-        let class = ClassItem {
-            date: NaiveDateTime::parse_from_str("2025-11-24 06:00:00", "%Y-%m-%d %H:%M:%S")
-                .unwrap(),
-            event_name: "WOD".to_string(),
-            coach: "Coach".to_string(),
-            duration_min: Some(60),
-            source_url: "https://example.com".to_string(),
-            location: None,
-        };
+        let class = sample_class();
         let bytes = exporter.generate(&[class], &settings);
         let body = String::from_utf8(bytes).unwrap();
         assert!(body.contains("BEGIN:VEVENT"));
         assert!(body.contains("CrossFit: WOD"));
+        assert!(body.contains(CALENDAR_NAME));
     }
 
     #[test]
@@ -142,13 +315,8 @@ mod tests {
         let exporter = ICalExporter::new();
         let settings = create_test_settings();
         let class = ClassItem {
-            date: NaiveDateTime::parse_from_str("2025-11-24 06:00:00", "%Y-%m-%d %H:%M:%S")
-                .unwrap(),
-            event_name: "WOD".to_string(),
-            coach: "Coach".to_string(),
-            duration_min: Some(60),
-            source_url: "https://example.com".to_string(),
-            location: Some("Boya-Żeleńskiego 15, 35-105 Rzeszów, Poland".to_string()),
+            location: Some("Boya-Żeleńskiego 15, 35-105 Rzeszów, Poland".into()),
+            ..sample_class()
         };
         let bytes = exporter.generate(&[class], &settings);
         let body = String::from_utf8(bytes).unwrap();
@@ -169,4 +337,74 @@ mod tests {
         // Check that X-ADDRESS is present with proper formatting
         assert!(normalized.contains("X-ADDRESS="));
     }
+
+    #[test]
+    fn test_generate_folds_and_escapes_lines() {
+        let exporter = ICalExporter::new();
+        let settings = create_test_settings();
+        let class = ClassItem {
+            event_name: "WOD; Strength, Conditioning".into(),
+            source_url: "https://example.com/kalendarz-zajec?day=2025-11-24&view=Agenda".into(),
+            ..sample_class()
+        };
+        let bytes = exporter.generate(&[class], &settings);
+        let body = String::from_utf8(bytes).unwrap();
+
+        assert!(body.starts_with("BEGIN:VCALENDAR\r\n"));
+        assert!(body.ends_with("END:VEVENT\r\nEND:VCALENDAR\r\n"));
+        // Every physical line must fit in 75 octets after folding
+        assert!(body.split("\r\n").all(|line| line.len() <= MAX_LINE_OCTETS));
+
+        let normalized = body.replace("\r\n ", "");
+        assert!(normalized.contains("SUMMARY:CrossFit: WOD\\; Strength\\, Conditioning\r\n"));
+        assert!(
+            normalized.contains("LOCATION:Boya-Żeleńskiego 15\\, 35-105 Rzeszów\\, Poland\r\n")
+        );
+        assert!(normalized.contains("DESCRIPTION:CrossFit Class\\nCoach: Coach\\nSource: "));
+        assert!(normalized.contains("DTSTART:20251124T060000\r\n"));
+        assert!(normalized.contains("DTEND:20251124T070000\r\n"));
+    }
+
+    #[test]
+    fn test_generate_uid() {
+        let exporter = ICalExporter::new();
+        let settings = create_test_settings();
+        let class = ClassItem {
+            event_name: "Open Gym".into(),
+            coach: "Jan Kowalski".into(),
+            duration_min: None,
+            ..sample_class()
+        };
+        let bytes = exporter.generate(&[class], &settings);
+        let body = String::from_utf8(bytes).unwrap();
+        assert!(body.contains("UID:20251124T060000-Open-Gym-Jan-Kowalski-crossfit-timetable\r\n"));
+    }
+
+    #[test]
+    fn test_generate_per_class_location() {
+        let exporter = ICalExporter::new();
+        let settings = create_test_settings();
+        let class = sample_class();
+        let classes = [
+            ClassItem {
+                location: Some("Other Gym".into()),
+                ..class.clone()
+            },
+            ClassItem {
+                date: class.date + Duration::hours(1),
+                event_name: "HYROX".into(),
+                ..class
+            },
+        ];
+        let bytes = exporter.generate(&classes, &settings);
+        let body = String::from_utf8(bytes).unwrap();
+        let normalized = body.replace("\r\n ", "");
+
+        assert_eq!(body.matches("BEGIN:VEVENT").count(), 2);
+        assert!(normalized.contains("LOCATION:Other Gym\r\n"));
+        assert!(normalized.contains("X-ADDRESS=Other Gym;"));
+        assert!(
+            normalized.contains("LOCATION:Boya-Żeleńskiego 15\\, 35-105 Rzeszów\\, Poland\r\n")
+        );
+    }
 }
@@ -1,14 +1,21 @@
+use std::sync::Arc;
+
 use chrono::NaiveDateTime;
-use serde::{Deserialize, Serialize};
+use serde::Serialize;
 use utoipa::ToSchema;
 
-#[derive(Debug, Clone, Serialize, Deserialize, PartialEq, ToSchema)]
+// Serialize-only; strings are shared across rows of one week via interning
+#[derive(Debug, Clone, Serialize, PartialEq, ToSchema)]
 pub struct ClassItem {
     #[schema(value_type = String, format = "date-time", example = "2025-11-24T06:00:00")]
     pub date: NaiveDateTime,
-    pub event_name: String,
-    pub coach: String,
+    #[schema(value_type = String)]
+    pub event_name: Arc<str>,
+    #[schema(value_type = String)]
+    pub coach: Arc<str>,
     pub duration_min: Option<u32>,
-    pub source_url: String,
-    pub location: Option<String>,
+    #[schema(value_type = String)]
+    pub source_url: Arc<str>,
+    #[schema(value_type = Option<String>)]
+    pub location: Option<Arc<str>>,
 }
@@ -1,13 +1,61 @@
+use std::collections::HashSet;
 use std::sync::Arc;
+use std::time::Duration;
 
-use chrono::{Datelike, NaiveDate, NaiveDateTime, NaiveTime};
+use chrono::{Datelike, NaiveDate, NaiveTime};
+use futures::{StreamExt, TryStreamExt, stream};
+use once_cell::sync::Lazy;
 use regex::Regex;
-use scraper::{Html, Selector};
+use reqwest::StatusCode;
+use reqwest::header::{self, HeaderValue};
+use scraper::{ElementRef, Html, Selector};
 use thiserror::Error;
+use tokio::sync::Mutex;
+use tokio::time::Instant;
 use url::Url;
 
+use crate::cache::TtlCache;
 use crate::models::ClassItem;
 
+const AGENDA_TABLE_CLASS: &str = "calendar_table_agenda";
+// Upper bound for a whole request, so a stalled upstream cannot pin a handler
+const REQUEST_TIMEOUT: Duration = Duration::from_secs(30);
+const CONNECT_TIMEOUT: Duration = Duration::from_secs(10);
+// Keep idle upstream connections around between requests (reqwest's default
+// is 90s) and probe them, so repeat requests skip the TCP and TLS handshake
+const POOL_IDLE_TIMEOUT: Duration = Duration::from_secs(75);
+const TCP_KEEPALIVE: Duration = Duration::from_secs(60);
+// The gym address changes practically never, so it is refreshed hourly
+const LOCATION_CACHE_TTL: Duration = Duration::from_secs(60 * 60);
+// The agenda for a given week changes at most a few times a day
+const TIMETABLE_CACHE_TTL: Duration = Duration::from_secs(5 * 60);
+// Expired weeks are kept this long so they can be revalidated with a
+// conditional request instead of downloaded and parsed again
+const TIMETABLE_CACHE_RETENTION: Duration = Duration::from_secs(24 * 60 * 60);
+// Upper bound on agenda pages requested at once by fetch_weeks
+const MAX_CONCURRENT_WEEK_FETCHES: usize = 4;
+
+// Selectors are compiled once instead of on every parse
+static ADDRESS_SELECTOR: Lazy<Selector> = Lazy::new(|| selector("address"));
+static PARAGRAPH_SELECTOR: Lazy<Selector> = Lazy::new(|| selector("p"));
+static TABLE_SELECTOR: Lazy<Selector> = Lazy::new(|| selector("table.calendar_table_agenda"));
+static ROW_SELECTOR: Lazy<Selector> = Lazy::new(|| selector("tr"));
+static EVENT_NAME_SELECTOR: Lazy<Selector> = Lazy::new(|| selector("p.event_name"));
+static LINK_SELECTOR: Lazy<Selector> = Lazy::new(|| selector("a.schedule-agenda-link"));
+
+// Regexes live in statics too: cloning a Regex gives the copy a fresh, cold
+// match cache, so keeping them out of the scraper keeps its clones cheap and
+// lets every parse share the warmed caches
+static DATE_REGEX: Lazy<Regex> =
+    Lazy::new(|| Regex::new(r"(\d{4})-(\d{2})-(\d{2})").expect("regex compiles"));
+static TIME_REGEX: Lazy<Regex> = Lazy::new(|| {
+    Regex::new(r"^\s*(\d{1,2}):(\d{2})\b\s*(?:-\s*(\d{1,2}):(\d{2})\b)?").expect("regex compiles")
+});
+
+fn selector(css: &str) -> Selector {
+    Selector::parse(css).expect("selector compiles")
+}
+
 #[derive(Debug, Error)]
 pub enum ScrapeError {
     #[error("Date must be a Monday")]
@@ -18,26 +66,68 @@ pub enum ScrapeError {
     Http(#[from] reqwest::Error),
     #[error("Table with class schedule not found on the page")]
     MissingTable,
+    #[error("Parsing task was cancelled")]
+    Cancelled,
 }
 
 #[derive(Clone)]
 pub struct CrossfitScraper {
     client: reqwest::Client,
     base_url: Arc<Url>,
-    date_regex: Regex,
+    location_cache: Arc<Mutex<Option<CachedLocation>>>,
+    timetable_cache: Arc<TtlCache<NaiveDate, CachedWeek>>,
+}
+
+struct CachedLocation {
+    fetched_at: Instant,
+    location: Option<String>,
+}
+
+// A parsed week together with the validators the server sent for it
+#[derive(Clone)]
+struct CachedWeek {
+    etag: Option<HeaderValue>,
+    last_modified: Option<HeaderValue>,
+    records: Vec<ClassItem>,
 }
 
 impl CrossfitScraper {
     pub fn new(base_url: Url) -> Self {
+        // One client per scraper (and one scraper per app, shared via AppState)
+        // keeps the connection pool and TLS sessions alive across requests
+        let client = reqwest::Client::builder()
+            .timeout(REQUEST_TIMEOUT)
+            .connect_timeout(CONNECT_TIMEOUT)
+            .pool_idle_timeout(POOL_IDLE_TIMEOUT)
+            .tcp_keepalive(TCP_KEEPALIVE)
+            .build()
+            .expect("HTTP client builds");
+        Self::with_client(base_url, client)
+    }
+
+    // Same as `new`, but sends requests through the given client, so callers
+    // can share one connection pool or configure timeouts themselves
+    pub fn with_client(base_url: Url, client: reqwest::Client) -> Self {
         Self {
-            client: reqwest::Client::new(),
+            client,
             base_url: Arc::new(base_url),
-            date_regex: Regex::new(r"\d{4}-\d{2}-\d{2}").expect("regex compiles"),
+            location_cache: Arc::new(Mutex::new(None)),
+            timetable_cache: Arc::new(TtlCache::with_retention(
+                TIMETABLE_CACHE_TTL,
+                TIMETABLE_CACHE_RETENTION,
+            )),
         }
     }
 
     pub fn get_valid_monday(target: Option<NaiveDate>) -> Result<NaiveDate, ScrapeError> {
-        let today = chrono::Local::now().date_naive();
+        Self::get_valid_monday_at(target, chrono::Local::now().date_naive())
+    }
+
+    // Same as `get_valid_monday`, relative to the given `today`
+    pub fn get_valid_monday_at(
+        target: Option<NaiveDate>,
+        today: NaiveDate,
+    ) -> Result<NaiveDate, ScrapeError> {
         let monday = today - chrono::Duration::days(today.weekday().num_days_from_monday() as i64);
 
         if let Some(given) = target {
@@ -54,52 +144,54 @@ impl CrossfitScraper {
         }
     }
 
-    fn parse_time_range(&self, time_range: &str) -> Option<u32> {
-        let parts: Vec<&str> = time_range.split('-').collect();
-        if parts.len() != 2 {
-            return None;
-        }
-        let (start, end) = (parts[0].trim(), parts[1].trim());
-        let start_parts: Vec<&str> = start.split(':').collect();
-        let end_parts: Vec<&str> = end.split(':').collect();
-        if start_parts.len() != 2 || end_parts.len() != 2 {
-            return None;
-        }
-        let start_hour = start_parts[0].parse::<i32>().ok()?;
-        let start_min = start_parts[1].parse::<i32>().ok()?;
-        let end_hour = end_parts[0].parse::<i32>().ok()?;
-        let end_min = end_parts[1].parse::<i32>().ok()?;
+    // Parses "HH:MM - HH:MM" (end optional, surrounding whitespace allowed) into
+    // the start time and duration in minutes, with a single regex match
+    fn parse_time_range(&self, time_range: &str) -> Option<(NaiveTime, Option<u32>)> {
+        let caps = TIME_REGEX.captures(time_range)?;
+        let start_hour = caps[1].parse::<u32>().ok()?;
+        let start_min = caps[2].parse::<u32>().ok()?;
+        let start = NaiveTime::from_hms_opt(start_hour, start_min, 0)?;
 
-        let start_total = start_hour * 60 + start_min;
-        let end_total = end_hour * 60 + end_min;
-        (end_total - start_total).try_into().ok()
+        let duration = match (caps.get(3), caps.get(4)) {
+            (Some(end_hour), Some(end_min)) => {
+                let end_hour = end_hour.as_str().parse::<i64>().ok()?;
+                let end_min = end_min.as_str().parse::<i64>().ok()?;
+                let start_total = i64::from(start_hour) * 60 + i64::from(start_min);
+                (end_hour * 60 + end_min - start_total).try_into().ok()
+            }
+            _ => None,
+        };
+        Some((start, duration))
     }
 
     fn parse_agenda_date(&self, text: &str) -> Option<NaiveDate> {
-        let caps = self.date_regex.find(text)?;
-        NaiveDate::parse_from_str(caps.as_str(), "%Y-%m-%d").ok()
+        let caps = DATE_REGEX.captures(text)?;
+        // The regex already split out the components, so build the date
+        // directly instead of running them through a date parser again
+        NaiveDate::from_ymd_opt(
+            caps[1].parse().ok()?,
+            caps[2].parse().ok()?,
+            caps[3].parse().ok()?,
+        )
     }
 
     async fn fetch_html(&self, url: &Url) -> Result<String, ScrapeError> {
         let response = self
             .client
-            .get(url.as_str())
+            .get(url.clone())
             .send()
             .await?
             .error_for_status()?;
-        let body = response.text().await?;
-        Ok(body)
+        read_text(response).await
     }
 
     fn resolve_location(&self, html: &str) -> Option<String> {
-        let document = Html::parse_document(html);
-        let address_sel = Selector::parse("address").ok()?;
-        let p_sel = Selector::parse("p").ok()?;
-        let address = document.select(&address_sel).next()?;
+        let document = parse_element(html, "address", None, &ADDRESS_SELECTOR);
+        let address = document.select(&ADDRESS_SELECTOR).next()?;
 
         let mut lines = vec![];
-        for p in address.select(&p_sel) {
-            let text = p.text().collect::<Vec<_>>().join("").trim().to_string();
+        for p in address.select(&PARAGRAPH_SELECTOR) {
+            let text = trimmed_text(p);
             if text.is_empty() || text == "Kontakt" {
                 continue;
             }
@@ -120,12 +212,27 @@ impl CrossfitScraper {
     }
 
     pub async fn fetch_location(&self) -> Option<String> {
+        // Holding the lock across the fetch lets concurrent callers (one per
+        // requested week) wait for a single request instead of racing it
+        let mut cache = self.location_cache.lock().await;
+        if let Some(cached) = cache.as_ref()
+            && cached.fetched_at.elapsed() < LOCATION_CACHE_TTL
+        {
+            return cached.location.clone();
+        }
+
+        // Failed fetches are not cached so the next request retries
         let html = self
             .fetch_html(&self.base_url)
             .await
             .map_err(|err| tracing::warn!(error = %err, "failed to fetch location"))
             .ok()?;
-        self.resolve_location(&html)
+        let location = self.resolve_location(&html);
+        *cache = Some(CachedLocation {
+            fetched_at: Instant::now(),
+            location: location.clone(),
+        });
+        location
     }
 
     pub async fn fetch_timetable(
@@ -134,19 +241,105 @@ impl CrossfitScraper {
         location: Option<String>,
     ) -> Result<Vec<ClassItem>, ScrapeError> {
         let monday = Self::get_valid_monday(start_date)?;
+        self.fetch_weeks(&[monday], location).await
+    }
 
+    // Fetches several weeks concurrently, bounded so a multi-week request does
+    // not hit the upstream all at once, and returns their classes in week
+    // order. The first failing week drops the remaining fetches.
+    pub async fn fetch_weeks(
+        &self,
+        mondays: &[NaiveDate],
+        location: Option<String>,
+    ) -> Result<Vec<ClassItem>, ScrapeError> {
+        for &monday in mondays {
+            Self::get_valid_monday(Some(monday))?;
+        }
+
+        let weeks: Vec<CachedWeek> = stream::iter(mondays.iter().copied())
+            .map(|monday| self.cached_week(monday))
+            .buffered(MAX_CONCURRENT_WEEK_FETCHES)
+            .try_collect()
+            .await?;
+
+        // Parsed weeks are cached without a location, so callers that resolve
+        // the location differently still share the same entry; it is resolved
+        // once for all requested weeks
+        let location: Option<Arc<str>> = match location {
+            Some(loc) => Some(loc.into()),
+            None => self.fetch_location().await.map(Arc::from),
+        };
+        let mut records: Vec<ClassItem> = weeks.into_iter().flat_map(|week| week.records).collect();
+        if location.is_some() {
+            for record in &mut records {
+                record.location = location.clone();
+            }
+        }
+        Ok(records)
+    }
+
+    async fn cached_week(&self, monday: NaiveDate) -> Result<CachedWeek, ScrapeError> {
+        self.timetable_cache
+            .get_or_try_revalidate_with(monday, |stale| self.fetch_week(monday, stale))
+            .await
+    }
+
+    // Fetches and parses one week. With a previously cached copy the request
+    // is conditional, and a 304 answer reuses its records without downloading
+    // or parsing the page again.
+    async fn fetch_week(
+        &self,
+        monday: NaiveDate,
+        stale: Option<CachedWeek>,
+    ) -> Result<CachedWeek, ScrapeError> {
         let url = Url::parse_with_params(
             &format!("{}/kalendarz-zajec", self.base_url),
             &[("day", monday.to_string()), ("view", "Agenda".to_string())],
         )
         .unwrap();
 
-        let html = self.fetch_html(&url).await?;
-        let loc = match location {
-            Some(loc) => Some(loc),
-            None => self.fetch_location().await,
-        };
-        self.parse_timetable_html(&html, monday, loc, &url)
+        let mut request = self.client.get(url.clone());
+        if let Some(stale) = &stale {
+            if let Some(etag) = &stale.etag {
+                request = request.header(header::IF_NONE_MATCH, etag.clone());
+            }
+            if let Some(last_modified) = &stale.last_modified {
+                request = request.header(header::IF_MODIFIED_SINCE, last_modified.clone());
+            }
+        }
+
+        let response = request.send().await?;
+        if response.status() == StatusCode::NOT_MODIFIED
+            && let Some(stale) = stale
+        {
+            return Ok(stale);
+        }
+
+        let response = response.error_for_status()?;
+        let etag = response.headers().get(header::ETAG).cloned();
+        let last_modified = response.headers().get(header::LAST_MODIFIED).cloned();
+        let html = read_text(response).await?;
+
+        // Building the DOM and walking the agenda is pure CPU work, so it runs
+        // on the blocking pool instead of stalling other requests on this worker.
+        // Every field of the scraper is reference-counted, so the clone is cheap
+        let scraper = self.clone();
+        let records = tokio::task::spawn_blocking(move || {
+            scraper.parse_timetable_html(&html, monday, None, &url)
+        })
+        .await
+        .map_err(|err| {
+            if err.is_panic() {
+                std::panic::resume_unwind(err.into_panic());
+            }
+            ScrapeError::Cancelled
+        })??;
+
+        Ok(CachedWeek {
+            etag,
+            last_modified,
+            records,
+        })
     }
 
     pub fn parse_timetable_html(
@@ -156,118 +349,81 @@ impl CrossfitScraper {
         location: Option<String>,
         source_url: &Url,
     ) -> Result<Vec<ClassItem>, ScrapeError> {
-        let document = Html::parse_document(html);
-        let table_sel = Selector::parse("table.calendar_table_agenda").unwrap();
-        let row_sel = Selector::parse("tr").unwrap();
-        let cell_sel = Selector::parse("td").unwrap();
-        let event_sel = Selector::parse("p.event_name").unwrap();
-        let link_sel = Selector::parse("a.schedule-agenda-link").unwrap();
+        let document = parse_element(html, "table", Some(AGENDA_TABLE_CLASS), &TABLE_SELECTOR);
 
         let table = document
-            .select(&table_sel)
+            .select(&TABLE_SELECTOR)
             .next()
             .ok_or(ScrapeError::MissingTable)?;
 
+        let week = expected_monday..=expected_monday + chrono::Duration::days(6);
         let mut current_date: Option<NaiveDate> = None;
         let mut records: Vec<ClassItem> = Vec::new();
+        let location: Option<Arc<str>> = location.map(Arc::from);
+        let page_url: Arc<str> = Arc::from(source_url.as_str());
+        let mut strings = HashSet::new();
 
-        for row in table.select(&row_sel) {
-            let cells: Vec<_> = row.select(&cell_sel).collect();
-            if cells.is_empty() {
+        for row in table.select(&ROW_SELECTOR) {
+            // Rows have at most three cells, so walk the direct children in
+            // place instead of collecting every descendant td
+            let mut cells = row
+                .child_elements()
+                .filter(|cell| cell.value().name() == "td");
+            let Some(first_cell) = cells.next() else {
                 continue;
-            }
+            };
 
-            let (time_cell, content_cell) = if cells[0].value().attr("rowspan").is_some() {
-                let date_text = cells[0]
-                    .text()
-                    .collect::<Vec<_>>()
-                    .join("")
-                    .trim()
-                    .to_string();
+            let (time_cell, content_cell) = if first_cell.value().attr("rowspan").is_some() {
+                let date_text = trimmed_text(first_cell);
                 current_date = self.parse_agenda_date(&date_text);
-                if current_date.is_none() {
+                let Some(date_val) = current_date else {
                     continue;
-                }
-                if let Some(date_val) = current_date
-                    && (date_val < expected_monday
-                        || date_val > expected_monday + chrono::Duration::days(6))
-                {
+                };
+                if !week.contains(&date_val) {
                     continue;
                 }
-                (cells.get(1), cells.get(2))
+                (cells.next(), cells.next())
             } else {
-                (cells.first(), cells.get(1))
+                (Some(first_cell), cells.next())
             };
 
             let (Some(time_cell), Some(content_cell)) = (time_cell, content_cell) else {
                 continue;
             };
 
-            let time_range = time_cell
-                .text()
-                .collect::<Vec<_>>()
-                .join("")
-                .trim()
-                .to_string();
-            let duration_min = self.parse_time_range(&time_range);
-
-            let start_time_str = time_range.split('-').next().unwrap_or("").trim();
-            let time_parts: Vec<&str> = start_time_str.split(':').collect();
-            if time_parts.len() != 2 {
-                continue;
-            }
-            let hour = time_parts[0].parse::<u32>().ok();
-            let minute = time_parts[1].parse::<u32>().ok();
             let Some(date_base) = current_date else {
                 continue;
             };
-            let start_dt = match (hour, minute) {
-                (Some(h), Some(m)) => {
-                    let Some(time) = NaiveTime::from_hms_opt(h, m, 0) else {
-                        continue;
-                    };
-                    NaiveDateTime::new(date_base, time)
-                }
-                _ => continue,
-            };
 
-            let event_elem = content_cell.select(&event_sel).next();
-            let Some(event_elem) = event_elem else {
+            // Header and blank rows have no event name, so check for it before
+            // extracting and parsing any cell text
+            let Some(event_elem) = content_cell.select(&EVENT_NAME_SELECTOR).next() else {
                 continue;
             };
-            let event_name = event_elem
-                .text()
-                .collect::<Vec<_>>()
-                .join("")
-                .trim()
-                .to_string();
+            let event_name = trimmed_text(event_elem);
             if event_name.is_empty() {
                 continue;
             }
 
-            let mut coach = String::new();
-            for text in content_cell
-                .text()
-                .map(|t| t.trim())
-                .filter(|t| !t.is_empty())
-            {
-                if text == event_name {
-                    continue;
-                }
-                coach = text.to_string();
-                break;
-            }
+            // The time regex tolerates surrounding whitespace and trailing text
+            let time_range = time_cell.text().collect::<String>();
+            let Some((start_time, duration_min)) = self.parse_time_range(&time_range) else {
+                continue;
+            };
+            let start_dt = date_base.and_time(start_time);
+
+            let coach = intern(&mut strings, coach_after(event_elem));
 
             let source_url = content_cell
-                .select(&link_sel)
+                .select(&LINK_SELECTOR)
                 .next()
                 .and_then(|a| a.value().attr("href"))
-                .map(|href| format!("{}{}", self.base_url, href))
-                .unwrap_or_else(|| source_url.to_string());
+                .map(|href| intern(&mut strings, &format!("{}{}", self.base_url, href)))
+                .unwrap_or_else(|| Arc::clone(&page_url));
 
             records.push(ClassItem {
                 date: start_dt,
-                event_name: event_name.clone(),
+                event_name: intern(&mut strings, &event_name),
                 coach,
                 duration_min,
                 source_url,
@@ -275,90 +431,606 @@ impl CrossfitScraper {
             });
         }
 
+        // Start times almost always differ, so compare the strings lazily
         records.sort_by(|a, b| {
             a.date
                 .cmp(&b.date)
-                .then(a.event_name.cmp(&b.event_name))
-                .then(a.coach.cmp(&b.coach))
+                .then_with(|| a.event_name.cmp(&b.event_name))
+                .then_with(|| a.coach.cmp(&b.coach))
         });
+        // Parsed weeks stay cached for a long time, so drop the spare capacity
+        // left over from growing the vector row by row
+        records.shrink_to_fit();
         Ok(records)
     }
 }
 
+// Valid UTF-8 bodies, which the gym's pages are, skip the lossy decoding pass
+// Response::text makes without the charset feature. The buffer is reused only
+// when the Bytes own it uniquely; anything else is still decoded lossily
+async fn read_text(response: reqwest::Response) -> Result<String, ScrapeError> {
+    let body = Vec::from(response.bytes().await?);
+    Ok(String::from_utf8(body)
+        .unwrap_or_else(|err| String::from_utf8_lossy(err.as_bytes()).into_owned()))
+}
+
+// Returns the shared copy of `value`, so repeated event names, coaches and
+// links across a week's rows all point at a single allocation
+fn intern(strings: &mut HashSet<Arc<str>>, value: &str) -> Arc<str> {
+    if let Some(existing) = strings.get(value) {
+        return Arc::clone(existing);
+    }
+    let value: Arc<str> = Arc::from(value);
+    strings.insert(Arc::clone(&value));
+    value
+}
+
+// Collects an element's text straight into one String and only copies it
+// again when there is surrounding whitespace to drop
+fn trimmed_text(element: ElementRef) -> String {
+    let text: String = element.text().collect();
+    let trimmed = text.trim();
+    if trimmed.len() == text.len() {
+        text
+    } else {
+        trimmed.to_string()
+    }
+}
+
+// The coach is the first non-empty text following the event name, either as
+// a bare text node or wrapped in an element, so only the siblings after
+// `p.event_name` are visited instead of every text node of the cell
+fn coach_after<'a>(event_elem: ElementRef<'a>) -> &'a str {
+    event_elem
+        .next_siblings()
+        .find_map(|node| match ElementRef::wrap(node) {
+            Some(element) => element.text().map(str::trim).find(|t| !t.is_empty()),
+            None => node
+                .value()
+                .as_text()
+                .map(|text| text.trim())
+                .filter(|t| !t.is_empty()),
+        })
+        .unwrap_or_default()
+}
+
+// Parses only the first `tag` element (with `class` among its class tokens,
+// when given), skipping the navigation, scripts and styles around it. Falls
+// back to the whole document when the element cannot be located textually or
+// the slice does not hold what `selector` looks for.
+fn parse_element(html: &str, tag: &str, class: Option<&str>, selector: &Selector) -> Html {
+    if let Some(element) = find_element(html, tag, class) {
+        let fragment = Html::parse_fragment(element);
+        if fragment.select(selector).next().is_some() {
+            return fragment;
+        }
+    }
+    Html::parse_document(html)
+}
+
+fn find_element<'a>(html: &'a str, tag: &str, class: Option<&str>) -> Option<&'a str> {
+    let mut pos = 0;
+    while let Some(offset) = html[pos..].find('<') {
+        let start = pos + offset;
+        let rest = &html[start..];
+
+        // Comments, scripts and styles can quote markup that is not part of
+        // the page, so their contents are never searched
+        if let Some(skipped) = raw_text_len(rest) {
+            pos = start + skipped;
+            continue;
+        }
+
+        if opens_tag(rest, tag) {
+            let open_end = start + rest.find('>')? + 1;
+            if class.is_none_or(|class| has_class(&html[start..open_end], class)) {
+                return matching_close(html, start, tag).map(|end| &html[start..end]);
+            }
+            pos = open_end;
+            continue;
+        }
+        pos = start + 1;
+    }
+    None
+}
+
+// Length of the comment, script or style element starting at `rest`
+fn raw_text_len(rest: &str) -> Option<usize> {
+    if rest.starts_with("<!--") {
+        return Some(rest.find("-->").map_or(rest.len(), |end| end + "-->".len()));
+    }
+    ["script", "style"]
+        .into_iter()
+        .find(|tag| opens_tag(rest, tag))
+        .map(|tag| {
+            let close = format!("</{tag}");
+            rest.find(&close)
+                .map_or(rest.len(), |end| end + close.len())
+        })
+}
+
+// Whether `rest` starts with the opening tag of `tag` itself, not of a longer
+// tag name that begins the same way
+fn opens_tag(rest: &str, tag: &str) -> bool {
+    rest.strip_prefix('<')
+        .and_then(|rest| rest.strip_prefix(tag))
+        .and_then(|rest| rest.chars().next())
+        .is_some_and(|next| next.is_ascii_whitespace() || next == '>' || next == '/')
+}
+
+// Whether the opening tag has `class` as one whole token of its class
+// attribute, so e.g. `calendar_table_agenda_mobile` does not match
+fn has_class(open_tag: &str, class: &str) -> bool {
+    let mut rest = open_tag;
+    while let Some(found) = rest.find("class") {
+        let before = rest[..found].chars().next_back();
+        let after = rest[found + "class".len()..].trim_start();
+        rest = &rest[found + "class".len()..];
+        if !before.is_some_and(|c| c.is_ascii_whitespace()) {
+            continue;
+        }
+        let Some(value) = after.strip_prefix('=').map(str::trim_start) else {
+            continue;
+        };
+        let value = match value.chars().next() {
+            Some(quote @ ('"' | '\'')) => value[1..].split(quote).next().unwrap_or_default(),
+            _ => value
+                .split(|c: char| c.is_ascii_whitespace() || c == '>')
+                .next()
+                .unwrap_or_default(),
+        };
+        return value.split_ascii_whitespace().any(|token| token == class);
+    }
+    false
+}
+
+// End of the element opened at `start`, past its matching closing tag,
+// accounting for nested elements of the same kind
+fn matching_close(html: &str, start: usize, tag: &str) -> Option<usize> {
+    let close = format!("</{tag}");
+    let mut depth = 0usize;
+    let mut pos = start + 1;
+    while let Some(offset) = html[pos..].find('<') {
+        let at = pos + offset;
+        let rest = &html[at..];
+
+        // Tags quoted inside comments, scripts and styles do not count
+        if let Some(skipped) = raw_text_len(rest) {
+            pos = at + skipped;
+            continue;
+        }
+
+        if opens_tag(rest, tag) {
+            depth += 1;
+        } else if rest
+            .strip_prefix(close.as_str())
+            .and_then(|after| after.chars().next())
+            .is_some_and(|next| next == '>' || next.is_ascii_whitespace())
+        {
+            if depth == 0 {
+                return Some(at + rest.find('>')? + 1);
+            }
+            depth -= 1;
+        }
+        pos = at + 1;
+    }
+    None
+}
+
 #[cfg(test)]
 mod tests {
+    use httpmock::prelude::*;
+
     use super::*;
 
+    // Parsing never touches the network, so the parser tests share one scraper
+    static PARSER: Lazy<CrossfitScraper> =
+        Lazy::new(|| CrossfitScraper::new(Url::parse("https://example.com").unwrap()));
+
+    // The fetch tests share one client instead of building one per scraper.
+    // Each test runs on its own runtime and mock servers reuse ports, so the
+    // client keeps no idle connections that could outlive the runtime that
+    // opened them
+    static CLIENT: Lazy<reqwest::Client> = Lazy::new(|| {
+        reqwest::Client::builder()
+            .pool_max_idle_per_host(0)
+            .build()
+            .expect("HTTP client builds")
+    });
+
+    fn mock_scraper(mock_server: &MockServer) -> CrossfitScraper {
+        CrossfitScraper::with_client(Url::parse(&mock_server.base_url()).unwrap(), CLIENT.clone())
+    }
+
+    // Fixed "today" for the Monday validation tests, a Thursday
+    const TODAY: NaiveDate = NaiveDate::from_ymd_opt(2025, 11, 13).unwrap();
+    // Monday of the week the HTML fixtures describe
+    const FIXTURE_MONDAY: NaiveDate = NaiveDate::from_ymd_opt(2025, 12, 15).unwrap();
+
+    // Agenda pages shared with the router tests; `{monday}` stands in for the
+    // week's date. The second class of the two-class page inherits the date
+    // through rowspan and has its coach wrapped in an element.
+    const SINGLE_CLASS_AGENDA: &str = include_str!("../tests/data/agenda_single_class.html");
+    const TWO_CLASS_AGENDA: &str = include_str!("../tests/data/agenda_two_classes.html");
+
+    const CONTACT_PAGE: &str = r#"<html><body><address><p>Kontakt</p><p>Boya-Żeleńskiego 15</p><p>35-105 Rzeszów</p></address></body></html>"#;
+
+    // The fetch paths validate against the real clock, so their fixtures are
+    // anchored on this week's Monday
+    fn current_monday() -> NaiveDate {
+        let today = chrono::Local::now().date_naive();
+        today - chrono::Duration::days(today.weekday().num_days_from_monday() as i64)
+    }
+
+    // Fills an agenda template with the given week's Monday
+    fn agenda_for(template: &str, monday: NaiveDate) -> String {
+        template.replace("{monday}", &monday.to_string())
+    }
+
     #[test]
     fn test_get_valid_monday_valid() {
-        let today = chrono::Local::now().date_naive();
-        let monday = today - chrono::Duration::days(today.weekday().num_days_from_monday() as i64);
+        let monday = NaiveDate::from_ymd_opt(2025, 11, 10).unwrap();
         assert_eq!(
-            CrossfitScraper::get_valid_monday(Some(monday)).unwrap(),
+            CrossfitScraper::get_valid_monday_at(Some(monday), TODAY).unwrap(),
             monday
         );
     }
 
+    #[test]
+    fn test_get_valid_monday_none() {
+        assert_eq!(
+            CrossfitScraper::get_valid_monday_at(None, TODAY).unwrap(),
+            NaiveDate::from_ymd_opt(2025, 11, 10).unwrap()
+        );
+    }
+
     #[test]
     fn test_get_valid_monday_not_monday() {
         let tuesday = NaiveDate::from_ymd_opt(2025, 11, 11).unwrap();
-        let err = CrossfitScraper::get_valid_monday(Some(tuesday)).unwrap_err();
+        let err = CrossfitScraper::get_valid_monday_at(Some(tuesday), TODAY).unwrap_err();
         assert!(matches!(err, ScrapeError::InvalidMonday));
     }
 
+    #[test]
+    fn test_get_valid_monday_too_old() {
+        let old_monday = NaiveDate::from_ymd_opt(2025, 10, 27).unwrap();
+        let err = CrossfitScraper::get_valid_monday_at(Some(old_monday), TODAY).unwrap_err();
+        assert!(matches!(err, ScrapeError::TooOld));
+    }
+
     #[test]
     fn test_parse_time_range() {
-        let scraper = CrossfitScraper::new(Url::parse("https://example.com").unwrap());
-        assert_eq!(scraper.parse_time_range("06:00 - 07:00"), Some(60));
-        assert_eq!(scraper.parse_time_range("18:00-19:30"), Some(90));
-        assert_eq!(scraper.parse_time_range("invalid"), None);
+        let scraper = &*PARSER;
+        let time = |h, m| NaiveTime::from_hms_opt(h, m, 0);
+        let cases = [
+            ("06:00 - 07:00", time(6, 0), Some(60)),
+            ("18:00-19:30", time(18, 0), Some(90)),
+            ("09:15 - 10:00", time(9, 15), Some(45)),
+            ("\n  09:15\n", time(9, 15), None),
+            // Trailing labels after the times are ignored
+            ("07:00 - 08:00 (60 min)", time(7, 0), Some(60)),
+            ("06:00 Open Box", time(6, 0), None),
+            // An end before the start yields no duration
+            ("10:00 - 09:00", time(10, 0), None),
+            ("25:00", None, None),
+            ("invalid", None, None),
+        ];
+
+        for (input, start, duration) in cases {
+            let expected = start.map(|start| (start, duration));
+            assert_eq!(
+                scraper.parse_time_range(input),
+                expected,
+                "input: {input:?}"
+            );
+        }
     }
 
     #[test]
     fn test_parse_agenda_date() {
-        let scraper = CrossfitScraper::new(Url::parse("https://example.com").unwrap());
-        let parsed = scraper.parse_agenda_date("Pn, 2025-11-24");
-        assert_eq!(parsed, Some(NaiveDate::from_ymd_opt(2025, 11, 24).unwrap()));
-        assert!(scraper.parse_agenda_date("no date").is_none());
+        let scraper = &*PARSER;
+        let cases = [
+            ("Pn, 2025-11-24", NaiveDate::from_ymd_opt(2025, 11, 24)),
+            ("2025-12-01 (Pn)", NaiveDate::from_ymd_opt(2025, 12, 1)),
+            // Every weekday prefix the agenda uses goes through the same match
+            ("Wt, 2025-11-25", NaiveDate::from_ymd_opt(2025, 11, 25)),
+            ("Śr, 2025-11-26", NaiveDate::from_ymd_opt(2025, 11, 26)),
+            ("Czw, 2025-11-27", NaiveDate::from_ymd_opt(2025, 11, 27)),
+            ("Pt, 2025-11-28", NaiveDate::from_ymd_opt(2025, 11, 28)),
+            ("Sob, 2025-11-29", NaiveDate::from_ymd_opt(2025, 11, 29)),
+            ("Nd, 2025-11-30", NaiveDate::from_ymd_opt(2025, 11, 30)),
+            (
+                "\n    Pn, 2025-11-24\n",
+                NaiveDate::from_ymd_opt(2025, 11, 24),
+            ),
+            ("2024-02-29", NaiveDate::from_ymd_opt(2024, 2, 29)),
+            ("no date", None),
+            ("Pn, 2025-13-24", None),
+            // Matches the pattern but is not a real day
+            ("2025-02-29", None),
+            ("Pn, 24.11.2025", None),
+            // These two tell the regex apart from a whole-string
+            // NaiveDate::parse_from_str(text, "%Y-%m-%d"), which rejects text
+            // around the date and accepts an unpadded month
+            (
+                "Pn, 2025-11-24 06:00",
+                NaiveDate::from_ymd_opt(2025, 11, 24),
+            ),
+            ("2025-1-24", None),
+        ];
+
+        for (input, expected) in cases {
+            assert_eq!(
+                scraper.parse_agenda_date(input),
+                expected,
+                "input: {input:?}"
+            );
+        }
     }
 
     #[test]
     fn test_parse_timetable_html() {
-        let scraper = CrossfitScraper::new(Url::parse("https://example.com").unwrap());
+        let scraper = &*PARSER;
+        let page_url = "https://example.com/kalendarz";
+        let expected = [
+            (6, "WOD", "Tomasz Nowosielski"),
+            (7, "HYROX", "Jan Kowalski"),
+        ]
+        .map(|(hour, event, coach)| ClassItem {
+            date: FIXTURE_MONDAY.and_hms_opt(hour, 0, 0).unwrap(),
+            event_name: event.into(),
+            coach: coach.into(),
+            duration_min: Some(60),
+            source_url: page_url.into(),
+            location: None,
+        });
+
+        let result = scraper
+            .parse_timetable_html(
+                &agenda_for(TWO_CLASS_AGENDA, FIXTURE_MONDAY),
+                FIXTURE_MONDAY,
+                None,
+                &Url::parse(page_url).unwrap(),
+            )
+            .unwrap();
+
+        assert_eq!(result, expected);
+        // Both rows fall back to the page URL and share one copy of it
+        assert!(Arc::ptr_eq(&result[0].source_url, &result[1].source_url));
+    }
+
+    #[test]
+    fn test_find_element() {
+        let agenda = Some(AGENDA_TABLE_CLASS);
         let html = r#"
-        <html>
-        <body>
-        <table class="calendar_table_agenda">
-            <tr>
-                <td rowspan="2">Pn, 2025-12-15</td>
-                <td>06:00 - 07:00</td>
-                <td>
-                    <p class="event_name">WOD</p>
-                    Tomasz Nowosielski
-                </td>
-            </tr>
-            <tr>
-                <td>07:00 - 08:00</td>
-                <td>
-                    <p class="event_name">HYROX</p>
-                    Jan Kowalski
-                </td>
-            </tr>
-        </table>
-        </body>
-        </html>
+        <style>.calendar_table_agenda { width: 100%; }</style>
+        <script>const row = '<table class="calendar_table_agenda"></table>';</script>
+        <!-- <table class="calendar_table_agenda"></table> -->
+        <table id="nav"><tr><td>Menu</td></tr></table>
+        <table class="calendar_table_agenda_mobile"><tr><td>Mobile</td></tr></table>
+        <table class="wide calendar_table_agenda"><tr><td><table><tr><td>Nested</td></tr></table></td></tr></table>
+        <p>Footer</p>
         "#;
-        let monday = NaiveDate::from_ymd_opt(2025, 12, 15).unwrap();
-        let result = scraper
+        assert_eq!(
+            find_element(html, "table", agenda),
+            Some(
+                r#"<table class="wide calendar_table_agenda"><tr><td><table><tr><td>Nested</td></tr></table></td></tr></table>"#
+            )
+        );
+        assert_eq!(
+            find_element(
+                "<div><addresses></addresses><address><p>Kontakt</p></address></div>",
+                "address",
+                None
+            ),
+            Some("<address><p>Kontakt</p></address>")
+        );
+        assert_eq!(
+            find_element(
+                "<table class='calendar_table_agenda'></table>",
+                "table",
+                agenda
+            ),
+            Some("<table class='calendar_table_agenda'></table>")
+        );
+        // Unterminated or missing elements fall back to a full document parse
+        assert!(
+            find_element(
+                r#"<table class="calendar_table_agenda"><tr>"#,
+                "table",
+                agenda
+            )
+            .is_none()
+        );
+        assert!(find_element("<html></html>", "table", agenda).is_none());
+        // Closing tags quoted in comments or scripts do not end the element
+        let quoted = r#"<table class="calendar_table_agenda"><tr><td>A</td></tr><!-- </table> --><script>"</table>"</script><tr><td>B</td></tr></table><p>After</p>"#;
+        assert_eq!(
+            find_element(quoted, "table", agenda),
+            quoted.strip_suffix("<p>After</p>")
+        );
+        assert!(
+            find_element(
+                r#"<table data-class="calendar_table_agenda"></table>"#,
+                "table",
+                agenda
+            )
+            .is_none()
+        );
+    }
+
+    #[test]
+    fn test_parse_timetable_html_skips_decoy_tables() {
+        let html = format!(
+            r#"<script>document.write('<table class="calendar_table_agenda"></table>');</script>
+            <table class="calendar_table_agenda_mobile"><tr><td>Mobile</td></tr></table>
+            {}"#,
+            // A commented-out closing tag between the rows must not end the table
+            agenda_for(TWO_CLASS_AGENDA, FIXTURE_MONDAY).replacen(
+                "</tr>",
+                "</tr><!-- </table> -->",
+                1
+            )
+        );
+
+        let result = PARSER
             .parse_timetable_html(
-                html,
-                monday,
+                &html,
+                FIXTURE_MONDAY,
                 None,
                 &Url::parse("https://example.com/kalendarz").unwrap(),
             )
             .unwrap();
+
         assert_eq!(result.len(), 2);
-        assert_eq!(result[0].event_name, "WOD");
-        assert_eq!(result[1].event_name, "HYROX");
+    }
+
+    #[tokio::test]
+    async fn test_fetch_location_is_cached() {
+        let mock_server = MockServer::start_async().await;
+        let location_mock = mock_server
+            .mock_async(|when, then| {
+                when.method(GET).path("/");
+                then.status(200).body(CONTACT_PAGE);
+            })
+            .await;
+        let scraper = mock_scraper(&mock_server);
+
+        let first = scraper.fetch_location().await;
+        let second = scraper.fetch_location().await;
+
+        assert_eq!(
+            first.as_deref(),
+            Some("Boya-Żeleńskiego 15, 35-105 Rzeszów, Poland")
+        );
+        assert_eq!(first, second);
+        location_mock.assert_async().await;
+    }
+
+    #[tokio::test]
+    async fn test_fetch_timetable_parses_agenda() {
+        let mock_server = MockServer::start_async().await;
+        let monday = current_monday();
+        let html = agenda_for(SINGLE_CLASS_AGENDA, monday);
+        let agenda_mock = mock_server
+            .mock_async(|when, then| {
+                when.method(GET)
+                    .path_matches("kalendarz-zajec")
+                    .query_param("day", monday.to_string())
+                    .query_param("view", "Agenda");
+                then.status(200).body(html.as_str());
+            })
+            .await;
+        let scraper = mock_scraper(&mock_server);
+
+        let records = scraper
+            .fetch_timetable(Some(monday), Some("Gym".to_string()))
+            .await
+            .unwrap();
+
+        agenda_mock.assert_async().await;
+        assert_eq!(records.len(), 1);
+        let record = &records[0];
+        assert_eq!(record.date, monday.and_hms_opt(6, 0, 0).unwrap());
+        assert_eq!(&*record.event_name, "WOD");
+        assert_eq!(&*record.coach, "Tomasz Nowosielski");
+        assert_eq!(record.duration_min, Some(60));
+        assert!(record.source_url.contains(&format!("day={monday}")));
+        assert_eq!(record.location.as_deref(), Some("Gym"));
+    }
+
+    #[tokio::test]
+    async fn test_fetch_timetable_is_cached_per_week() {
+        let mock_server = MockServer::start_async().await;
+        let monday = current_monday();
+        let html = agenda_for(SINGLE_CLASS_AGENDA, monday);
+        let agenda_mock = mock_server
+            .mock_async(|when, then| {
+                when.method(GET).path_matches("kalendarz");
+                then.status(200).body(html.as_str());
+            })
+            .await;
+        let scraper = mock_scraper(&mock_server);
+
+        let first = scraper
+            .fetch_timetable(Some(monday), Some("Gym A".to_string()))
+            .await
+            .unwrap();
+        let second = scraper
+            .fetch_timetable(Some(monday), Some("Gym B".to_string()))
+            .await
+            .unwrap();
+
+        agenda_mock.assert_async().await;
+        assert_eq!(first.len(), 1);
+        assert_eq!(first[0].location.as_deref(), Some("Gym A"));
+        assert_eq!(second[0].location.as_deref(), Some("Gym B"));
+    }
+
+    #[tokio::test]
+    async fn test_fetch_weeks_keeps_week_order() {
+        let mock_server = MockServer::start_async().await;
+        let monday = current_monday();
+        let next_monday = monday + chrono::Duration::weeks(1);
+        for (day, template) in [
+            (monday, TWO_CLASS_AGENDA),
+            (next_monday, SINGLE_CLASS_AGENDA),
+        ] {
+            let html = agenda_for(template, day);
+            mock_server
+                .mock_async(|when, then| {
+                    when.method(GET)
+                        .path_matches("kalendarz")
+                        .query_param("day", day.to_string());
+                    then.status(200).body(html.as_str());
+                })
+                .await;
+        }
+        let scraper = mock_scraper(&mock_server);
+
+        let records = scraper
+            .fetch_weeks(&[monday, next_monday], Some("Gym".to_string()))
+            .await
+            .unwrap();
+
+        let events: Vec<_> = records.iter().map(|r| &*r.event_name).collect();
+        assert_eq!(events, ["WOD", "HYROX", "WOD"]);
+        assert!(records.windows(2).all(|pair| pair[0].date < pair[1].date));
+        assert!(records.iter().all(|r| r.location.as_deref() == Some("Gym")));
+    }
+
+    #[tokio::test]
+    async fn test_fetch_week_revalidates_with_etag() {
+        let mock_server = MockServer::start_async().await;
+        let not_modified_mock = mock_server
+            .mock_async(|when, then| {
+                when.method(GET)
+                    .path_matches("kalendarz")
+                    .header("If-None-Match", "\"v1\"");
+                then.status(304);
+            })
+            .await;
+        let scraper = mock_scraper(&mock_server);
+        let record = ClassItem {
+            date: FIXTURE_MONDAY.and_hms_opt(6, 0, 0).unwrap(),
+            event_name: "WOD".into(),
+            coach: "Coach".into(),
+            duration_min: Some(60),
+            source_url: mock_server.base_url().into(),
+            location: None,
+        };
+        let stale = CachedWeek {
+            etag: Some(HeaderValue::from_static("\"v1\"")),
+            last_modified: None,
+            records: vec![record.clone()],
+        };
+
+        let week = scraper
+            .fetch_week(FIXTURE_MONDAY, Some(stale))
+            .await
+            .unwrap();
+
+        not_modified_mock.assert_async().await;
+        assert_eq!(week.records, vec![record]);
     }
 }
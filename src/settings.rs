@@ -1,3 +1,5 @@
+use std::sync::Once;
+
 use config::{Config, ConfigError, Environment};
 use serde::{Deserialize, Serialize};
 use url::Url;
@@ -22,13 +24,20 @@ pub struct Settings {
     pub gym_location: String,
 }
 
+// .env only ever seeds the process environment, so it is looked up and read
+// once per process no matter how often settings are built
+static LOAD_DOTENV: Once = Once::new();
+
 impl Settings {
     pub fn from_env() -> Result<Self, ConfigError> {
-        let _ = dotenvy::dotenv();
+        LOAD_DOTENV.call_once(|| {
+            let _ = dotenvy::dotenv();
+        });
 
         let config = Config::builder()
-            // Load from environment variables with APP_ prefix
-            .add_source(Environment::with_prefix("APP").separator("_"))
+            // Load from environment variables with APP_ prefix. Keys are flat,
+            // so the underscores after the prefix stay part of the field name
+            .add_source(Environment::with_prefix("APP").prefix_separator("_"))
             .set_default(
                 "scraper_base_url",
                 "https://crossfit2-rzeszow.cms.efitness.com.pl",
@@ -55,27 +64,83 @@ mod tests {
     use super::*;
     use serial_test::serial;
     use std::env;
+    use std::ffi::OsString;
 
     // Note: Environment variable tests use unsafe blocks because env::set_var and
     // env::remove_var are marked unsafe in Rust 1.32+. Using serial_test to prevent
     // race conditions from parallel test execution.
 
+    // Every variable Settings reads, so tests can start from a clean slate
+    const APP_VARS: [&str; 10] = [
+        "APP_SCRAPER_BASE_URL",
+        "APP_DEBUG",
+        "APP_AUTH_TOKEN",
+        "APP_ENABLE_SWAGGER",
+        "APP_PORT",
+        "APP_LOCATION",
+        "APP_GYM_LATITUDE",
+        "APP_GYM_LONGITUDE",
+        "APP_GYM_TITLE",
+        "APP_GYM_LOCATION",
+    ];
+
+    // Records the original value of each variable it changes and restores only
+    // those on drop, so a failing assertion cannot leak variables into the next
+    // test
+    #[derive(Default)]
+    struct EnvGuard {
+        saved: Vec<(&'static str, Option<OsString>)>,
+    }
+
+    impl EnvGuard {
+        // Guard with every APP_ variable removed, restored again on drop
+        fn cleared() -> Self {
+            let mut env = Self::default();
+            for key in APP_VARS {
+                env.remove(key);
+            }
+            env
+        }
+
+        fn set(&mut self, key: &'static str, value: &str) {
+            self.save(key);
+            unsafe {
+                env::set_var(key, value);
+            }
+        }
+
+        fn remove(&mut self, key: &'static str) {
+            self.save(key);
+            unsafe {
+                env::remove_var(key);
+            }
+        }
+
+        fn save(&mut self, key: &'static str) {
+            if !self.saved.iter().any(|(saved, _)| *saved == key) {
+                self.saved.push((key, env::var_os(key)));
+            }
+        }
+    }
+
+    impl Drop for EnvGuard {
+        fn drop(&mut self) {
+            for (key, value) in self.saved.drain(..) {
+                unsafe {
+                    match value {
+                        Some(value) => env::set_var(key, value),
+                        None => env::remove_var(key),
+                    }
+                }
+            }
+        }
+    }
+
     #[test]
     #[serial]
     fn test_settings_with_defaults() {
-        // Arrange - clear relevant env vars
-        unsafe {
-            env::remove_var("APP_SCRAPER_BASE_URL");
-            env::remove_var("APP_DEBUG");
-            env::remove_var("APP_AUTH_TOKEN");
-            env::remove_var("APP_ENABLE_SWAGGER");
-            env::remove_var("APP_PORT");
-            env::remove_var("APP_LOCATION");
-            env::remove_var("APP_GYM_LATITUDE");
-            env::remove_var("APP_GYM_LONGITUDE");
-            env::remove_var("APP_GYM_TITLE");
-            env::remove_var("APP_GYM_LOCATION");
-        }
+        // Arrange - start without any APP_ variables
+        let _env = EnvGuard::cleared();
 
         // Act
         let settings = Settings::from_env().unwrap();
@@ -102,120 +167,76 @@ mod tests {
     #[test]
     #[serial]
     fn test_settings_with_environment_variables() {
-        // This test verifies Settings can load from environment variables
-        // Note: Environment variable testing is tricky because the config library
-        // reads them at build time, not when set_var is called in the test.
-        // This test mainly verifies the struct fields are configurable.
-
-        // Create a Settings struct directly to verify the fields
-        let settings = Settings {
-            scraper_base_url: Url::parse("https://example.com").unwrap(),
-            debug: true,
-            auth_token: "test-token-123".to_string(),
-            enable_swagger: true,
-            port: 9000,
-            location: Some("Test Location".to_string()),
-            gym_latitude: 50.0386,
-            gym_longitude: 22.0026,
-            gym_title: "CrossFit 2.0 Rzeszów".to_string(),
-            gym_location: "Boya-Żeleńskiego 15, 35-105 Rzeszów, Poland".to_string(),
-        };
-
-        // Assert struct fields work as expected
+        // Arrange - override every multi-word setting away from its default
+        let mut env = EnvGuard::cleared();
+        env.set("APP_SCRAPER_BASE_URL", "https://example.com");
+        env.set("APP_AUTH_TOKEN", "test-token-123");
+        env.set("APP_ENABLE_SWAGGER", "false");
+        env.set("APP_GYM_LATITUDE", "51.5");
+        env.set("APP_GYM_LONGITUDE", "-0.125");
+        env.set("APP_GYM_TITLE", "Test Gym");
+        env.set("APP_GYM_LOCATION", "1 Test Street");
+
+        // Act
+        let settings = Settings::from_env().unwrap();
+
+        // Assert
         assert_eq!(
             settings.scraper_base_url,
             Url::parse("https://example.com").unwrap()
         );
-        assert!(settings.debug);
         assert_eq!(settings.auth_token, "test-token-123");
-        assert!(settings.enable_swagger);
-        assert_eq!(settings.port, 9000);
-        assert_eq!(settings.location, Some("Test Location".to_string()));
-        assert_eq!(settings.gym_latitude, 50.0386);
-        assert_eq!(settings.gym_longitude, 22.0026);
-        assert_eq!(settings.gym_title, "CrossFit 2.0 Rzeszów");
-        assert_eq!(
-            settings.gym_location,
-            "Boya-Żeleńskiego 15, 35-105 Rzeszów, Poland"
-        );
+        assert!(!settings.enable_swagger);
+        assert_eq!(settings.gym_latitude, 51.5);
+        assert_eq!(settings.gym_longitude, -0.125);
+        assert_eq!(settings.gym_title, "Test Gym");
+        assert_eq!(settings.gym_location, "1 Test Street");
     }
 
     #[test]
     #[serial]
     fn test_settings_boolean_parsing() {
-        // Cleanup - clear all relevant env vars first to ensure clean state
-        unsafe {
-            env::remove_var("APP_DEBUG");
-            env::remove_var("APP_ENABLE_SWAGGER");
-            env::remove_var("APP_SCRAPER_BASE_URL");
-            env::remove_var("APP_AUTH_TOKEN");
-            env::remove_var("APP_PORT");
-            env::remove_var("APP_LOCATION");
-            env::remove_var("APP_GYM_LATITUDE");
-            env::remove_var("APP_GYM_LONGITUDE");
-            env::remove_var("APP_GYM_TITLE");
-            env::remove_var("APP_GYM_LOCATION");
-        }
-
-        // Test true
-        unsafe {
-            env::set_var("APP_DEBUG", "true");
-        }
-        let settings = Settings::from_env().unwrap();
-        assert!(settings.debug);
-
-        // Test false
-        unsafe {
-            env::set_var("APP_DEBUG", "false");
+        // Arrange - start without any APP_ variables
+        let mut env = EnvGuard::cleared();
+
+        let cases = [
+            ("true", true),
+            ("True", true),
+            ("TRUE", true),
+            ("1", true),
+            ("yes", true),
+            ("false", false),
+            ("False", false),
+            ("0", false),
+            ("no", false),
+        ];
+        for (value, expected) in cases {
+            env.set("APP_DEBUG", value);
+            let settings = Settings::from_env().unwrap();
+            assert_eq!(settings.debug, expected, "APP_DEBUG={value}");
         }
-        let settings = Settings::from_env().unwrap();
-        assert!(!settings.debug);
 
-        // Test case insensitivity (depends on config crate behavior)
-        unsafe {
-            env::set_var("APP_ENABLE_SWAGGER", "True");
-        }
-        let settings = Settings::from_env().unwrap();
-        assert!(settings.enable_swagger);
-
-        // Cleanup
-        unsafe {
-            env::remove_var("APP_DEBUG");
-            env::remove_var("APP_ENABLE_SWAGGER");
+        // enable_swagger defaults to true, so only false values show parsing
+        for value in ["False", "0"] {
+            env.set("APP_ENABLE_SWAGGER", value);
+            let settings = Settings::from_env().unwrap();
+            assert!(!settings.enable_swagger, "APP_ENABLE_SWAGGER={value}");
         }
     }
 
     #[test]
     #[serial]
     fn test_settings_port_parsing() {
-        // Cleanup - clear all relevant env vars first to ensure clean state
-        unsafe {
-            env::remove_var("APP_DEBUG");
-            env::remove_var("APP_ENABLE_SWAGGER");
-            env::remove_var("APP_SCRAPER_BASE_URL");
-            env::remove_var("APP_AUTH_TOKEN");
-            env::remove_var("APP_PORT");
-            env::remove_var("APP_LOCATION");
-            env::remove_var("APP_GYM_LATITUDE");
-            env::remove_var("APP_GYM_LONGITUDE");
-            env::remove_var("APP_GYM_TITLE");
-            env::remove_var("APP_GYM_LOCATION");
-        }
+        // Arrange - start without any APP_ variables
+        let mut env = EnvGuard::cleared();
 
         // Arrange
-        unsafe {
-            env::set_var("APP_PORT", "3000");
-        }
+        env.set("APP_PORT", "3000");
 
         // Act
         let settings = Settings::from_env().unwrap();
 
         // Assert
         assert_eq!(settings.port, 3000);
-
-        // Cleanup
-        unsafe {
-            env::remove_var("APP_PORT");
-        }
     }
 }
@@ -14,9 +14,11 @@ mod tests {
 
     #[test]
     fn test_validate_weeks() {
-        assert!(validate_weeks(1).is_ok());
-        assert!(validate_weeks(6).is_ok());
-        assert!(validate_weeks(0).is_err());
-        assert!(validate_weeks(7).is_err());
+        for weeks in 1..=6 {
+            assert_eq!(validate_weeks(weeks).ok(), Some(weeks), "weeks: {weeks}");
+        }
+        for weeks in [0, 7, u8::MAX] {
+            assert!(validate_weeks(weeks).is_err(), "weeks: {weeks}");
+        }
     }
 }
@@ -1,22 +1,36 @@
 use axum::{
+    Router,
     body::Body,
     http::{Request, StatusCode, header},
+    response::IntoResponse,
 };
+use chrono::{Datelike, Duration as ChronoDuration, Local};
+use crossfit_timetable::handlers::{healthz_live, healthz_ready, root};
 use crossfit_timetable::ical::ICalExporter;
 use crossfit_timetable::scraper::CrossfitScraper;
 use crossfit_timetable::settings::Settings;
 use crossfit_timetable::{AppState, build_router};
 use httpmock::prelude::*;
+use once_cell::sync::Lazy;
 use std::sync::Arc;
 use tower::Service;
 use url::Url;
 
+/// Token accepted by the test state
+const TEST_TOKEN: &str = "test-token-123";
+
+/// `path` with the test token appended to its query string
+fn token_uri(path: &str) -> String {
+    let separator = if path.contains('?') { '&' } else { '?' };
+    format!("{path}{separator}token={TEST_TOKEN}")
+}
+
 /// Helper function to create test app state with mocked server
 fn create_test_state(mock_server_url: Url) -> AppState {
     let settings = Settings {
         scraper_base_url: mock_server_url.clone(),
         debug: true,
-        auth_token: "test-token-123".to_string(),
+        auth_token: TEST_TOKEN.to_string(),
         enable_swagger: true,
         port: 8080,
         location: Some("Test Location".to_string()),
@@ -33,23 +47,59 @@ fn create_test_state(mock_server_url: Url) -> AppState {
     }
 }
 
+/// Upstream for tests that must not reach the network: the discard port on
+/// loopback refuses connections immediately, so a request that slips through
+/// fails fast instead of reaching a real host or waiting on DNS
+const OFFLINE_UPSTREAM: &str = "http://127.0.0.1:9";
+
+/// Router for tests that never reach the scraper (static routes, auth and
+/// validation failures); it is built once and cheaply cloned per test
+static OFFLINE_ROUTER: Lazy<Router> =
+    Lazy::new(|| build_router(create_test_state(Url::parse(OFFLINE_UPSTREAM).unwrap())));
+
+fn offline_app() -> Router {
+    OFFLINE_ROUTER.clone()
+}
+
+/// Agenda page without any classes
+const EMPTY_AGENDA: &str =
+    r#"<html><body><table class="calendar_table_agenda"></table></body></html>"#;
+
+/// Agenda pages for the current week; `{monday}` stands in for its date
+const SINGLE_CLASS_AGENDA: &str = include_str!("data/agenda_single_class.html");
+const TWO_CLASS_AGENDA: &str = include_str!("data/agenda_two_classes.html");
+
+/// Fills an agenda template with this week's Monday, the only week the
+/// scraper accepts without a date argument
+fn current_week_agenda(template: &str) -> String {
+    let today = Local::now().date_naive();
+    let monday = today - ChronoDuration::days(today.weekday().num_days_from_monday() as i64);
+    template.replace("{monday}", &monday.to_string())
+}
+
+/// Serves `body` for every agenda request made to `mock_server`
+async fn mock_agenda(mock_server: &MockServer, body: &str) {
+    mock_server
+        .mock_async(|when, then| {
+            when.method(GET).path_matches("kalendarz");
+            then.status(200).body(body);
+        })
+        .await;
+}
+
 /// Helper to extract response body as string
 async fn response_body_string(body: Body) -> String {
     let bytes = axum::body::to_bytes(body, usize::MAX).await.unwrap();
     String::from_utf8(bytes.to_vec()).unwrap()
 }
 
+// Leaf handlers without state or extractors are called directly, skipping
+// request building and routing
+
 #[tokio::test]
 async fn test_root_endpoint() {
-    // Arrange
-    let state = create_test_state(Url::parse("http://example.com").unwrap());
-    let mut app = build_router(state);
-
     // Act
-    let response = app
-        .call(Request::builder().uri("/").body(Body::empty()).unwrap())
-        .await
-        .unwrap();
+    let response = root().await.into_response();
 
     // Assert
     assert_eq!(response.status(), StatusCode::OK);
@@ -62,20 +112,8 @@ async fn test_root_endpoint() {
 
 #[tokio::test]
 async fn test_healthz_ready() {
-    // Arrange
-    let state = create_test_state(Url::parse("http://example.com").unwrap());
-    let mut app = build_router(state);
-
     // Act
-    let response = app
-        .call(
-            Request::builder()
-                .uri("/healthz/ready")
-                .body(Body::empty())
-                .unwrap(),
-        )
-        .await
-        .unwrap();
+    let response = healthz_ready().await.into_response();
 
     // Assert
     assert_eq!(response.status(), StatusCode::OK);
@@ -86,20 +124,8 @@ async fn test_healthz_ready() {
 
 #[tokio::test]
 async fn test_healthz_live() {
-    // Arrange
-    let state = create_test_state(Url::parse("http://example.com").unwrap());
-    let mut app = build_router(state);
-
     // Act
-    let response = app
-        .call(
-            Request::builder()
-                .uri("/healthz/live")
-                .body(Body::empty())
-                .unwrap(),
-        )
-        .await
-        .unwrap();
+    let response = healthz_live().await.into_response();
 
     // Assert
     assert_eq!(response.status(), StatusCode::OK);
@@ -109,251 +135,100 @@ async fn test_healthz_live() {
 }
 
 #[tokio::test]
-async fn test_timetable_no_auth_token() {
-    // Arrange
-    let state = create_test_state(Url::parse("http://example.com").unwrap());
-    let mut app = build_router(state);
-
-    // Act
-    let response = app
-        .call(
-            Request::builder()
-                .uri("/timetable")
-                .body(Body::empty())
-                .unwrap(),
-        )
-        .await
-        .unwrap();
-
-    // Assert - should fail without token
-    assert_eq!(response.status(), StatusCode::UNAUTHORIZED);
-}
-
-#[tokio::test]
-async fn test_timetable_invalid_auth_token() {
-    // Arrange
-    let state = create_test_state(Url::parse("http://example.com").unwrap());
-    let mut app = build_router(state);
-
-    // Act
-    let response = app
-        .call(
-            Request::builder()
-                .uri("/timetable?token=invalid-token")
-                .body(Body::empty())
-                .unwrap(),
-        )
-        .await
-        .unwrap();
-
-    // Assert
-    assert_eq!(response.status(), StatusCode::UNAUTHORIZED);
-}
-
-#[tokio::test]
-async fn test_timetable_valid_auth_bearer() {
-    // Arrange
-    let mock_server = MockServer::start();
-    let state = create_test_state(Url::parse(&mock_server.base_url()).unwrap());
-
-    // Mock the scraper response with empty classes (will result in 404)
-    mock_server.mock(|when, then| {
-        when.method(GET).path_matches("kalendarz");
-        then.status(200)
-            .body(r#"<html><body><table class="calendar_table_agenda"></table></body></html>"#);
-    });
-
-    let mut app = build_router(state);
-
-    // Act
-    let response = app
-        .call(
-            Request::builder()
-                .uri("/timetable")
-                .header(header::AUTHORIZATION, "Bearer test-token-123")
-                .body(Body::empty())
-                .unwrap(),
-        )
-        .await
-        .unwrap();
-
-    // Assert - should fail with 404 since no classes found
-    assert_eq!(response.status(), StatusCode::NOT_FOUND);
-}
-
-#[tokio::test]
-async fn test_timetable_valid_auth_query() {
-    // Arrange
-    let mock_server = MockServer::start();
-    let state = create_test_state(Url::parse(&mock_server.base_url()).unwrap());
-
-    // Mock the scraper response
-    mock_server.mock(|when, then| {
-        when.method(GET).path_matches("kalendarz");
-        then.status(200)
-            .body(r#"<html><body><table class="calendar_table_agenda"></table></body></html>"#);
-    });
-
-    let mut app = build_router(state);
-
-    // Act
-    let response = app
-        .call(
-            Request::builder()
-                .uri("/timetable?token=test-token-123")
-                .body(Body::empty())
-                .unwrap(),
-        )
-        .await
-        .unwrap();
-
-    // Assert - should authenticate but fail with 404 since no classes
-    assert_eq!(response.status(), StatusCode::NOT_FOUND);
-}
-
-#[tokio::test]
-async fn test_timetable_invalid_weeks_param() {
-    // Arrange
-    let state = create_test_state(Url::parse("http://example.com").unwrap());
-    let mut app = build_router(state);
-
-    // Act - weeks = 0 is invalid
-    let response = app
-        .call(
-            Request::builder()
-                .uri("/timetable?token=test-token-123&weeks=0")
-                .body(Body::empty())
-                .unwrap(),
-        )
-        .await
-        .unwrap();
-
-    // Assert
-    assert_eq!(response.status(), StatusCode::BAD_REQUEST);
-}
-
-#[tokio::test]
-async fn test_timetable_weeks_too_high() {
-    // Arrange
-    let state = create_test_state(Url::parse("http://example.com").unwrap());
-    let mut app = build_router(state);
-
-    // Act - weeks = 7 is invalid (max is 6)
-    let response = app
-        .call(
-            Request::builder()
-                .uri("/timetable?token=test-token-123&weeks=7")
-                .body(Body::empty())
-                .unwrap(),
-        )
-        .await
-        .unwrap();
-
-    // Assert
-    assert_eq!(response.status(), StatusCode::BAD_REQUEST);
+async fn test_rejected_requests() {
+    // Requests that fail authentication or validation before the scraper runs
+    let cases = [
+        (
+            "timetable-no-token",
+            "/timetable".to_string(),
+            StatusCode::UNAUTHORIZED,
+        ),
+        (
+            "timetable-invalid-token",
+            "/timetable?token=invalid-token".to_string(),
+            StatusCode::UNAUTHORIZED,
+        ),
+        (
+            "timetable-weeks-zero",
+            token_uri("/timetable?weeks=0"),
+            StatusCode::BAD_REQUEST,
+        ),
+        (
+            "timetable-weeks-too-high",
+            token_uri("/timetable?weeks=7"),
+            StatusCode::BAD_REQUEST,
+        ),
+        (
+            "ical-no-token",
+            "/timetable.ical".to_string(),
+            StatusCode::UNAUTHORIZED,
+        ),
+        (
+            "ical-weeks-too-high",
+            token_uri("/timetable.ical?weeks=7"),
+            StatusCode::BAD_REQUEST,
+        ),
+    ];
+    let mut app = offline_app();
+
+    for (name, uri, expected) in cases {
+        // Act
+        let response = app
+            .call(Request::builder().uri(uri).body(Body::empty()).unwrap())
+            .await
+            .unwrap();
+
+        // Assert
+        assert_eq!(response.status(), expected, "case {name}");
+    }
 }
 
 #[tokio::test]
-async fn test_timetable_with_single_class() {
-    // Arrange
-    let mock_server = MockServer::start();
-    let state = create_test_state(Url::parse(&mock_server.base_url()).unwrap());
-
-    // Get the current Monday
-    use chrono::{Datelike, Duration as ChronoDuration, Local};
-    let today = Local::now().date_naive();
-    let monday = today - ChronoDuration::days(today.weekday().num_days_from_monday() as i64);
-
-    // Mock response with a single class (using current Monday)
-    let html_response = format!(
-        r#"
-        <html>
-        <body>
-        <table class="calendar_table_agenda">
-            <tr>
-                <td rowspan="1">Pn, {}</td>
-                <td>06:00 - 07:00</td>
-                <td>
-                    <p class="event_name">WOD</p>
-                    Tomasz Nowosielski
-                </td>
-            </tr>
-        </table>
-        </body>
-        </html>
-    "#,
-        monday.format("%Y-%m-%d")
-    );
-
-    mock_server.mock(|when, then| {
-        when.method(GET).path_matches("kalendarz");
-        then.status(200).body(html_response.as_str());
-    });
-
-    let mut app = build_router(state);
-
-    // Act
-    let response = app
-        .call(
-            Request::builder()
-                .uri("/timetable?token=test-token-123")
-                .body(Body::empty())
-                .unwrap(),
-        )
-        .await
-        .unwrap();
-
-    // Assert
-    assert_eq!(response.status(), StatusCode::OK);
-
-    let body = response_body_string(response.into_body()).await;
-    assert!(body.contains("WOD"));
-    assert!(body.contains("Tomasz Nowosielski"));
+async fn test_authenticated_requests_without_classes() {
+    // Arrange - every authenticated request reaches an empty agenda
+    let mock_server = MockServer::start_async().await;
+    mock_agenda(&mock_server, EMPTY_AGENDA).await;
+    let mut app = build_router(create_test_state(
+        Url::parse(&mock_server.base_url()).unwrap(),
+    ));
+
+    let cases = [
+        (
+            "timetable-bearer",
+            "/timetable".to_string(),
+            Some(format!("Bearer {TEST_TOKEN}")),
+        ),
+        ("timetable-query", token_uri("/timetable"), None),
+        ("ical-query", token_uri("/timetable.ical"), None),
+    ];
+
+    for (name, uri, authorization) in cases {
+        let mut request = Request::builder().uri(uri);
+        if let Some(value) = authorization {
+            request = request.header(header::AUTHORIZATION, value);
+        }
+
+        // Act
+        let response = app
+            .call(request.body(Body::empty()).unwrap())
+            .await
+            .unwrap();
+
+        // Assert - authenticated, but no classes were found
+        assert_eq!(response.status(), StatusCode::NOT_FOUND, "case {name}");
+    }
 }
 
 #[tokio::test]
 async fn test_timetable_with_multiple_classes() {
     // Arrange
-    let mock_server = MockServer::start();
+    let mock_server = MockServer::start_async().await;
     let state = create_test_state(Url::parse(&mock_server.base_url()).unwrap());
 
-    // Get the current Monday
-    use chrono::{Datelike, Duration as ChronoDuration, Local};
-    let today = Local::now().date_naive();
-    let monday = today - ChronoDuration::days(today.weekday().num_days_from_monday() as i64);
-
     // Mock response with multiple classes
-    let html_response = format!(
-        r#"
-        <html>
-        <body>
-        <table class="calendar_table_agenda">
-            <tr>
-                <td rowspan="2">Pn, {}</td>
-                <td>06:00 - 07:00</td>
-                <td>
-                    <p class="event_name">WOD</p>
-                    Tomasz Nowosielski
-                </td>
-            </tr>
-            <tr>
-                <td>07:00 - 08:00</td>
-                <td>
-                    <p class="event_name">HYROX</p>
-                    Jan Kowalski
-                </td>
-            </tr>
-        </table>
-        </body>
-        </html>
-    "#,
-        monday.format("%Y-%m-%d")
-    );
+    let html_response = current_week_agenda(TWO_CLASS_AGENDA);
 
-    mock_server.mock(|when, then| {
-        when.method(GET).path_matches("kalendarz");
-        then.status(200).body(html_response.as_str());
-    });
+    mock_agenda(&mock_server, &html_response).await;
 
     let mut app = build_router(state);
 
@@ -361,7 +236,7 @@ async fn test_timetable_with_multiple_classes() {
     let response = app
         .call(
             Request::builder()
-                .uri("/timetable?token=test-token-123")
+                .uri(token_uri("/timetable"))
                 .body(Body::empty())
                 .unwrap(),
         )
@@ -371,100 +246,32 @@ async fn test_timetable_with_multiple_classes() {
     // Assert
     assert_eq!(response.status(), StatusCode::OK);
 
+    // One parsed response covers what a single-class page would: both rows
+    // with their coaches and durations, in start-time order
     let body = response_body_string(response.into_body()).await;
-    assert!(body.contains("WOD"));
-    assert!(body.contains("HYROX"));
-    assert!(body.contains("Tomasz Nowosielski"));
-    assert!(body.contains("Jan Kowalski"));
-}
-
-#[tokio::test]
-async fn test_ical_endpoint_no_auth() {
-    // Arrange
-    let state = create_test_state(Url::parse("http://example.com").unwrap());
-    let mut app = build_router(state);
-
-    // Act
-    let response = app
-        .call(
-            Request::builder()
-                .uri("/timetable.ical")
-                .body(Body::empty())
-                .unwrap(),
-        )
-        .await
-        .unwrap();
-
-    // Assert
-    assert_eq!(response.status(), StatusCode::UNAUTHORIZED);
-}
-
-#[tokio::test]
-async fn test_ical_endpoint_empty_classes() {
-    // Arrange
-    let mock_server = MockServer::start();
-    let state = create_test_state(Url::parse(&mock_server.base_url()).unwrap());
-
-    // Mock empty response
-    mock_server.mock(|when, then| {
-        when.method(GET).path_matches("kalendarz");
-        then.status(200)
-            .body(r#"<html><body><table class="calendar_table_agenda"></table></body></html>"#);
-    });
-
-    let mut app = build_router(state);
-
-    // Act
-    let response = app
-        .call(
-            Request::builder()
-                .uri("/timetable.ical?token=test-token-123")
-                .body(Body::empty())
-                .unwrap(),
-        )
-        .await
-        .unwrap();
-
-    // Assert - should return 404 when no classes found
-    assert_eq!(response.status(), StatusCode::NOT_FOUND);
+    let classes: serde_json::Value = serde_json::from_str(&body).unwrap();
+    let classes = classes.as_array().unwrap();
+    assert_eq!(classes.len(), 2);
+    for (class, (event, coach)) in classes
+        .iter()
+        .zip([("WOD", "Tomasz Nowosielski"), ("HYROX", "Jan Kowalski")])
+    {
+        assert_eq!(class["event_name"], event);
+        assert_eq!(class["coach"], coach);
+        assert_eq!(class["duration_min"], 60);
+    }
 }
 
 #[tokio::test]
 async fn test_ical_endpoint_with_classes() {
     // Arrange
-    let mock_server = MockServer::start();
+    let mock_server = MockServer::start_async().await;
     let state = create_test_state(Url::parse(&mock_server.base_url()).unwrap());
 
-    // Get the current Monday
-    use chrono::{Datelike, Duration as ChronoDuration, Local};
-    let today = Local::now().date_naive();
-    let monday = today - ChronoDuration::days(today.weekday().num_days_from_monday() as i64);
-
     // Mock response with classes
-    let html_response = format!(
-        r#"
-        <html>
-        <body>
-        <table class="calendar_table_agenda">
-            <tr>
-                <td rowspan="1">Pn, {}</td>
-                <td>06:00 - 07:00</td>
-                <td>
-                    <p class="event_name">WOD</p>
-                    Coach Name
-                </td>
-            </tr>
-        </table>
-        </body>
-        </html>
-    "#,
-        monday.format("%Y-%m-%d")
-    );
+    let html_response = current_week_agenda(SINGLE_CLASS_AGENDA);
 
-    mock_server.mock(|when, then| {
-        when.method(GET).path_matches("kalendarz");
-        then.status(200).body(html_response.as_str());
-    });
+    mock_agenda(&mock_server, &html_response).await;
 
     let mut app = build_router(state);
 
@@ -472,7 +279,7 @@ async fn test_ical_endpoint_with_classes() {
     let response = app
         .call(
             Request::builder()
-                .uri("/timetable.ical?token=test-token-123")
+                .uri(token_uri("/timetable.ical"))
                 .body(Body::empty())
                 .unwrap(),
         )
@@ -505,39 +312,13 @@ async fn test_ical_endpoint_with_classes() {
 #[tokio::test]
 async fn test_ical_endpoint_multiple_weeks() {
     // Arrange
-    let mock_server = MockServer::start();
+    let mock_server = MockServer::start_async().await;
     let state = create_test_state(Url::parse(&mock_server.base_url()).unwrap());
 
-    // Get the current Monday
-    use chrono::{Datelike, Duration as ChronoDuration, Local};
-    let today = Local::now().date_naive();
-    let monday = today - ChronoDuration::days(today.weekday().num_days_from_monday() as i64);
-
     // Mock response with classes
-    let html_response = format!(
-        r#"
-        <html>
-        <body>
-        <table class="calendar_table_agenda">
-            <tr>
-                <td rowspan="1">Pn, {}</td>
-                <td>06:00 - 07:00</td>
-                <td>
-                    <p class="event_name">WOD</p>
-                    Coach
-                </td>
-            </tr>
-        </table>
-        </body>
-        </html>
-    "#,
-        monday.format("%Y-%m-%d")
-    );
+    let html_response = current_week_agenda(SINGLE_CLASS_AGENDA);
 
-    mock_server.mock(|when, then| {
-        when.method(GET).path_matches("kalendarz");
-        then.status(200).body(html_response.as_str());
-    });
+    mock_agenda(&mock_server, &html_response).await;
 
     let mut app = build_router(state);
 
@@ -545,7 +326,7 @@ async fn test_ical_endpoint_multiple_weeks() {
     let response = app
         .call(
             Request::builder()
-                .uri("/timetable.ical?token=test-token-123&weeks=2")
+                .uri(token_uri("/timetable.ical?weeks=2"))
                 .body(Body::empty())
                 .unwrap(),
         )